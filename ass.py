@@ -17,12 +17,13 @@ Style: Top,Arial,60,&H00FFFFFF,&H00000000,&H4D000000,&H81000000,-1,0,0,0,100,100
 Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
 """
 
-    def __init__(self, start_time: str, end_time: str, text_content: str, is_top: bool = False):
+    def __init__(self, start_time: str, end_time: str, text_content: str, is_top: bool = False, name: str = ""):
         self.start_time: str = start_time
         self.end_time: str = end_time
         self.text_content: str = text_content
         self.style_name: str = "Top" if is_top else "Default"
         self.is_top: bool = is_top
+        self.name: str = name
 
     def convert_timestamp(self, s: str):
         h, m, rest = s.split(":")
@@ -32,4 +33,4 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
     @override
     def __str__(self):
         processed_text = self.text_content.replace('\n', '\\n')
-        return f"Dialogue: 0,{self.convert_timestamp(self.start_time)},{self.convert_timestamp(self.end_time)},{self.style_name},,0,0,0,,{processed_text}\n"
\ No newline at end of file
+        return f"Dialogue: 0,{self.convert_timestamp(self.start_time)},{self.convert_timestamp(self.end_time)},{self.style_name},{self.name},0,0,0,,{processed_text}\n"
\ No newline at end of file
@@ -0,0 +1,176 @@
+import argparse
+import io
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from vstools import clip_async_render, vs
+
+from detection import BAND_HEIGHT, BAND_WIDTH, band_changes, segment_events
+from filter import SUBTITLE_PROPS, Dilation, Filter, default_regions
+
+core = vs.core
+
+
+def measure_fps(clip: vs.VideoNode, name: str) -> float:
+    start = time.perf_counter()
+    clip_async_render(clip, None, f"{name}...")
+    fps = clip.num_frames / (time.perf_counter() - start)
+    print(f"{name}: {fps:.1f} fps")
+    return fps
+
+
+def synthetic_subtitles(frames: int, width: int, height: int) -> vs.VideoNode:
+    clip = core.std.BlankClip(format=vs.YUV420P8, width=width, height=height, length=frames, keep=True)
+    return clip.std.SetFrameProps(psmAvg=1.0, _SceneChangePrev=0, _SceneChangeNext=1, PrevDiff=0.0, NextDiff=0.02)
+
+
+def python_props_rename(clip: vs.VideoNode, name: str) -> vs.VideoNode:
+    """The per-frame Python callback Filter used before switching to akarin.PropExpr."""
+
+    def _rename(n, f):
+        f = f.copy()
+        for prop in f.props:
+            f.props[f"{name}{prop}"] = f.props[prop]
+            del f.props[prop]
+        return f
+
+    return clip.std.ModifyFrame(clip, _rename)
+
+
+def bench_props(args: argparse.Namespace) -> None:
+    from vstools import merge_clip_props
+
+    filter = Filter("", 0, "", 0, Path("."))
+    blank = core.std.BlankClip(format=vs.YUV420P8, width=args.width, height=args.height * 5, length=args.frames)
+    subtitles: Dict[str, vs.VideoNode] = {
+        region.name: synthetic_subtitles(args.frames, args.width, args.height) for region in default_regions()
+    }
+
+    python_merge = merge_clip_props(blank, *(python_props_rename(clip, name) for name, clip in subtitles.items()))
+    native_merge = filter._merge_props(blank, subtitles)
+
+    first = native_merge.get_frame(0).props
+    if not all(f"{name}{prop}" in first for name in subtitles for prop in SUBTITLE_PROPS):
+        raise RuntimeError("akarin.PropExpr did not copy every detection prop.")
+
+    python_fps = measure_fps(python_merge, "ModifyFrame rename + merge_clip_props")
+    native_fps = measure_fps(native_merge, "akarin.PropExpr")
+    print(f"Speedup: {native_fps / python_fps:.2f}x")
+
+
+def synthetic_mask(frames: int, width: int, height: int) -> vs.VideoNode:
+    clip = core.std.BlankClip(format=vs.GRAY8, width=width, height=height, length=frames, keep=True)
+    # Sparse strokes that move every frame, roughly like a text mask.
+    return clip.akarin.Expr("X N 3 * + 97 % 6 < Y 13 % 4 < and 255 0 ?")
+
+
+def bench_dilation(args: argparse.Namespace) -> None:
+    mask = synthetic_mask(args.frames, args.width, args.height)
+    filter = Filter("", 0, "", 0, Path("."))
+
+    dilated: Dict[Dilation, vs.VideoNode] = {}
+    for dilation in Dilation:
+        filter.dilation = dilation
+        dilated[dilation] = filter._dilate(mask, 10)
+
+    reference = dilated[Dilation.ITERATE]
+    for dilation, clip in dilated.items():
+        diff = core.std.PlaneStats(reference, clip)
+        differing = sum(diff.get_frame(n).props["PlaneStatsDiff"] > 0 for n in range(0, clip.num_frames, 50))
+        measure_fps(clip, f"{dilation.value} dilation")
+        print(f"  frames differing from iterate (every 50th frame): {differing}")
+
+    if not args.clean or not args.hardsub:
+        return
+
+    reference_events = None
+    for dilation in Dilation:
+        filter = Filter(args.clean, 0, args.hardsub, 0, Path("."), dilation=dilation)
+        _, _, _, merge_props, _ = filter._build_graph()
+        events = segment_events(filter._get_props(merge_props))
+        if reference_events is None:
+            reference_events = events
+        identical = len(events) == len(reference_events) and bool((events == reference_events).all())
+        print(f"{dilation.value}: {len(events)} events, identical to iterate: {identical}")
+
+
+def bench_coarse(args: argparse.Namespace) -> None:
+    if not args.clean or not args.hardsub:
+        raise SystemExit("The coarse benchmark needs --clean and --hardsub.")
+
+    filter = Filter(args.clean, 0, args.hardsub, 0, Path("."))
+    _, _, _, merge_props, masks = filter._build_graph()
+
+    start = time.perf_counter()
+    reference_events = segment_events(filter._get_props(merge_props))
+    print(f"every frame: {time.perf_counter() - start:.1f}s, {len(reference_events)} events")
+
+    for step in (4, 8, 16, 32):
+        start = time.perf_counter()
+        events = segment_events(filter._get_props_coarse(masks, step))
+        identical = len(events) == len(reference_events) and bool((events == reference_events).all())
+        print(f"step {step}: {time.perf_counter() - start:.1f}s, {len(events)} events, identical: {identical}")
+
+
+def synthetic_band(background: np.ndarray, text: str, quality: int) -> np.ndarray:
+    """Outlined text on a textured background, JPEG-encoded and shrunk to a band thumbnail like `_build_graph`."""
+    height, width = background.shape
+    image = Image.fromarray(background)
+    font = ImageFont.load_default(size=height * 2 // 5)
+    ImageDraw.Draw(image).text(
+        (width // 2, height // 2), text, font=font, fill=235, anchor="mm", stroke_width=height // 40, stroke_fill=16
+    )
+    encoded = io.BytesIO()
+    image.save(encoded, "JPEG", quality=quality)
+    with Image.open(encoded) as decoded:
+        return np.asarray(decoded.convert("L").resize((BAND_WIDTH, BAND_HEIGHT), Image.BILINEAR)).reshape(1, 1, -1)
+
+
+def bench_bands(args: argparse.Namespace) -> None:
+    """Check that the incremental fingerprint flags a corrected word but not a re-encode of the same line."""
+    rng = np.random.default_rng(0)
+    background = rng.normal(90, 40, (args.height, args.width)).clip(0, 255).astype(np.uint8)
+    background = np.asarray(Image.fromarray(background).filter(ImageFilter.GaussianBlur(2)))
+    original = synthetic_band(background, "I told you not to go there", 90)
+
+    cases = {
+        "re-encoded": ("I told you not to go there", False),
+        "one letter": ("I told you not to go thete", True),
+        "punctuation": ("I told you, not to go there", True),
+        "new line": ("We should leave right now", True),
+    }
+    for name, (text, expected) in cases.items():
+        edited = synthetic_band(background, text, 50)
+        distance = int(np.abs(edited.astype(np.int16) - original).max())
+        flagged = bool(band_changes(original, edited, Filter.BAND_THRESHOLD)[0])
+        print(f"{name}: max distance {distance}, changed: {flagged}")
+        if flagged != expected:
+            raise RuntimeError(f"Band fingerprint {'missed' if expected else 'falsely flagged'} the {name} band.")
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], None]] = {
+    "props": bench_props,
+    "dilation": bench_dilation,
+    "coarse": bench_coarse,
+    "bands": bench_bands,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parts of the VapourSynth subtitle detection pipeline.")
+    _ = parser.add_argument("benchmark", choices=list(BENCHMARKS), help="Benchmark to run.")
+    _ = parser.add_argument("--frames", type=int, default=5000, help="Synthetic clip length. Default: 5000")
+    _ = parser.add_argument("--width", type=int, default=1280, help="Synthetic clip width. Default: 1280")
+    _ = parser.add_argument("--height", type=int, default=144, help="Synthetic subtitle strip height. Default: 144")
+    _ = parser.add_argument("--clean", type=str, default=None, help="Clean sample clip for event comparisons.")
+    _ = parser.add_argument("--hardsub", type=str, default=None, help="Hardsub sample clip for event comparisons.")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
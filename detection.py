@@ -0,0 +1,209 @@
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Large enough that a changed letter still moves a few thumbnail pixels by more than re-encoding noise does.
+BAND_WIDTH: int = 128
+BAND_HEIGHT: int = 16
+
+
+class DetectionSignal:
+    """Per-frame subtitle detection signal, one column per location.
+
+    `frames` is a structured array with one record per frame; every field holds one value per location, so
+    `frames["psmAvg"]` is a (num_frames, num_locations) array. `scene_diff_prev`/`scene_diff_next` keep the mask
+    difference to the neighbouring frames the scene change flags were cut from, NaN where it was not measured.
+    `band` is a `BAND_WIDTH` x `BAND_HEIGHT` luma thumbnail of the hardsub inside each location, all zero where it
+    was not rendered, so a later upload of the episode can be compared frame by frame.
+    """
+
+    VERSION: int = 4
+
+    def __init__(self, frames: np.ndarray, locations: Sequence[str], fps_num: int, fps_den: int):
+        self.frames: np.ndarray = frames
+        self.locations: List[str] = list(locations)
+        self.fps_num: int = fps_num
+        self.fps_den: int = fps_den
+
+    @staticmethod
+    def dtype(num_locations: int) -> np.dtype:
+        return np.dtype(
+            [
+                ("psmAvg", np.float32, (num_locations,)),
+                ("scene_change_prev", np.bool_, (num_locations,)),
+                ("scene_change_next", np.bool_, (num_locations,)),
+                ("scene_diff_prev", np.float32, (num_locations,)),
+                ("scene_diff_next", np.float32, (num_locations,)),
+                ("band", np.uint8, (num_locations, BAND_WIDTH * BAND_HEIGHT)),
+            ]
+        )
+
+    @classmethod
+    def empty(cls, num_frames: int, locations: Sequence[str], fps_num: int, fps_den: int) -> "DetectionSignal":
+        return cls(np.zeros(num_frames, dtype=cls.dtype(len(locations))), locations, fps_num, fps_den)
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.frames)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write through a file handle so numpy does not append a second .npz suffix.
+        with path.open("wb") as signal_file:
+            np.savez_compressed(
+                signal_file,
+                frames=self.frames,
+                locations=np.array(self.locations),
+                fps=np.array([self.fps_num, self.fps_den]),
+                version=np.array(self.VERSION),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "DetectionSignal":
+        with np.load(path) as data:
+            if int(data["version"]) != cls.VERSION:
+                raise ValueError(f"Unsupported detection signal version {int(data['version'])} in {path}")
+            fps_num, fps_den = (int(value) for value in data["fps"])
+            return cls(data["frames"], [str(location) for location in data["locations"]], fps_num, fps_den)
+
+    def with_scene_thresholds(self, thresholds: Sequence[float]) -> "DetectionSignal":
+        """Return a copy whose scene change flags are cut from the stored mask differences at `thresholds`.
+
+        Flags of frames without a measured difference are kept.
+        """
+        frames = self.frames.copy()
+        limits = np.asarray(thresholds, dtype=np.float32)
+        for side in ("prev", "next"):
+            diffs = frames[f"scene_diff_{side}"]
+            frames[f"scene_change_{side}"] = np.where(np.isnan(diffs), frames[f"scene_change_{side}"], diffs > limits)
+        return DetectionSignal(frames, self.locations, self.fps_num, self.fps_den)
+
+    def matches(self, num_frames: int, locations: Sequence[str], fps_num: int, fps_den: int) -> bool:
+        return (
+            self.num_frames == num_frames
+            and self.locations == list(locations)
+            and (self.fps_num, self.fps_den) == (fps_num, fps_den)
+        )
+
+
+def band_changes(previous: np.ndarray, current: np.ndarray, threshold: int) -> np.ndarray:
+    """Flag the frames whose (frames, locations, pixels) band thumbnails differ between two uploads.
+
+    An edited word only touches a few pixels of the thumbnail, so a frame counts as changed as soon as any pixel of
+    any location moves by more than `threshold`; a mean over the band would drown the edit in the unchanged text.
+    """
+    distance = np.abs(current.astype(np.int16) - previous.astype(np.int16)).max(axis=2)
+    return (distance > threshold).any(axis=1)
+
+
+EVENT_DTYPE = np.dtype([("start", np.int64), ("end", np.int64), ("location", np.int16)])
+
+
+def segment_events(
+    signal: DetectionSignal, threshold: float | Sequence[float] = 0.9, min_duration: int = 0, merge_gap: int = 0
+) -> np.ndarray:
+    """Pair scene-change starts and ends into subtitle events for every location at once.
+
+    A frame whose psmAvg reaches `threshold` (one value, or one per location) opens an event on a previous-frame
+    scene change and closes the open event on a next-frame scene change. Events shorter than `min_duration` frames
+    are dropped, and events of the same location separated by at most `merge_gap` frames are merged. Returns an
+    `EVENT_DTYPE` array ordered by end frame, then location.
+    """
+    num_frames = signal.num_frames
+    valid = signal.frames["psmAvg"] >= np.asarray(threshold, dtype=np.float32)
+    prev = signal.frames["scene_change_prev"]
+    starts = valid & prev
+    ends = valid & ~prev & signal.frames["scene_change_next"]
+
+    # Lay the locations end to end (index = location * num_frames + frame) so one searchsorted pairs all of them.
+    start_idx = np.flatnonzero(starts.T.ravel())
+    end_idx = np.flatnonzero(ends.T.ravel())
+    if start_idx.size == 0:
+        return np.empty(0, dtype=EVENT_DTYPE)
+    opener = np.searchsorted(start_idx, end_idx) - 1
+    paired_start = start_idx[np.maximum(opener, 0)]
+
+    keep = (opener >= 0) & (paired_start // num_frames == end_idx // num_frames)
+    # Only the first end after a start closes it; the event is gone for any later end.
+    keep[1:] &= opener[1:] != opener[:-1]
+
+    events = np.empty(int(keep.sum()), dtype=EVENT_DTYPE)
+    events["start"] = paired_start[keep] % num_frames
+    events["end"] = end_idx[keep] % num_frames
+    events["location"] = end_idx[keep] // num_frames
+
+    if min_duration > 0:
+        events = events[events["end"] - events["start"] >= min_duration]
+
+    if merge_gap > 0 and len(events) > 1:
+        events = events[np.lexsort((events["start"], events["location"]))]
+        joined = (events["location"][1:] == events["location"][:-1]) & (
+            events["start"][1:] - events["end"][:-1] <= merge_gap
+        )
+        group_starts = np.flatnonzero(np.concatenate(([True], ~joined)))
+        merged = events[group_starts]
+        merged["end"] = np.maximum.reduceat(events["end"], group_starts)
+        events = merged
+
+    return events[np.lexsort((events["location"], events["end"]))]
+
+
+PSM_THRESHOLD_RANGE: Tuple[float, float] = (0.5, 0.98)
+SCENE_THRESHOLD_RANGE: Tuple[float, float] = (0.003, 0.05)
+MIN_CALIBRATION_SAMPLES: int = 20
+
+
+def valley_threshold(values: np.ndarray, bins: int = 64) -> float | None:
+    """Return the bottom of the deepest valley between two modes of the histogram of `values`, or None.
+
+    Every bin is scored by how far it lies below the lower of the highest bins on its left and on its right, so a
+    small mode (the rare scene changes among many static frames) is split off as well as a large one. The middle of
+    the best run of bins is returned. A valley must fall below half of that lower peak, so the noise of a unimodal
+    histogram is not taken for one.
+    """
+    values = values[np.isfinite(values)]
+    if values.size < MIN_CALIBRATION_SAMPLES or values.min() == values.max():
+        return None
+    counts, edges = np.histogram(values, bins)
+    smooth = np.convolve(counts, np.ones(3) / 3, mode="same")
+    left_peak = np.maximum.accumulate(smooth)
+    right_peak = np.maximum.accumulate(smooth[::-1])[::-1]
+    depth = np.minimum(left_peak, right_peak) - smooth
+    low = int(np.argmax(depth))
+    if depth[low] <= 0 or smooth[low] > (smooth[low] + depth[low]) / 2:
+        return None
+
+    high = low
+    while high + 1 < bins and depth[high + 1] == depth[low]:
+        high += 1
+    return float((edges[low] + edges[high + 1]) / 2)
+
+
+def calibrate_thresholds(
+    signal: DetectionSignal, psm_thresholds: Sequence[float], scene_thresholds: Sequence[float]
+) -> Tuple[List[float], List[float]]:
+    """Derive per-location psmAvg and scene change thresholds from the distribution of the signal itself.
+
+    The mask differences of a location are a large mass of near-zero noise plus the jumps where subtitles change,
+    so their cut is taken on a log scale. psmAvg is then only looked at on frames that open an event, where it
+    separates real text from partial masks. A location without enough samples for a clear split keeps the given
+    value, and so does the scene threshold of one whose differences were not measured (coarse rendering). Results
+    are clamped to `PSM_THRESHOLD_RANGE` and `SCENE_THRESHOLD_RANGE`.
+    """
+    psm_out = [float(value) for value in psm_thresholds]
+    scene_out = [float(value) for value in scene_thresholds]
+    for i in range(len(signal.locations)):
+        diffs = signal.frames["scene_diff_prev"][:, i]
+        if np.isnan(diffs).any():
+            starts = signal.frames["scene_change_prev"][:, i]
+        else:
+            cut = valley_threshold(np.log10(diffs[diffs > 0]))
+            if cut is not None:
+                scene_out[i] = float(np.clip(10**cut, *SCENE_THRESHOLD_RANGE))
+            starts = diffs > scene_out[i]
+
+        cut = valley_threshold(signal.frames["psmAvg"][starts, i])
+        if cut is not None:
+            psm_out[i] = float(np.clip(cut, *PSM_THRESHOLD_RANGE))
+    return (psm_out, scene_out)
@@ -1,12 +1,18 @@
+import asyncio
+import warnings
 from enum import Enum
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Dict
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, Iterator, List, Mapping, NamedTuple
+
+if TYPE_CHECKING:
+    import numpy as np
 
 
 class Engine(Enum):
     VAPOURSYNTH = "vapoursynth"
     VIDEOSUBFINDER = "videosubfinder"
+    HARDSUB = "hardsub"
 
     def __str__(self):
         return self.value
@@ -18,21 +24,99 @@ class Engine(Enum):
                 return engine
         raise ValueError(f"Unknown engine: {value}. Available: {[e.value for e in cls]}")
 
+class OCRImage(NamedTuple):
+    """An image to OCR: a file path, encoded image bytes, or an HxW / HxWx3 uint8 array."""
+
+    name: str
+    data: "Path | bytes | np.ndarray"
+
+class OCRResult(NamedTuple):
+    image_name: str
+    text: str
+    error: Exception | None = None
+
 class OCREngine(ABC):
     """Abstract base class for OCR engines."""
-    
-    @abstractmethod
+
     def __call__(self, images_dir: Path) -> Dict[str, str]:
+        return self._collect(self.stream(images_dir))
+
+    def ocr_images(self, images: Mapping[str, "bytes | np.ndarray"]) -> Dict[str, str]:
+        """OCR in-memory images keyed by the caller's image names."""
+        return self._collect(self.stream_images(OCRImage(name, data) for name, data in images.items()))
+
+    def stream(self, images_dir: Path) -> Iterator[OCRResult]:
+        """Yield one result per image in the directory as soon as it is done, in completion order."""
+        from utils import collect_images
+
+        images = collect_images(images_dir)
+        if not images:
+            warnings.warn(f"No images found in {images_dir}")
+            return
+
+        yield from self.stream_images(OCRImage(img_path.name, img_path) for img_path in images)
+
+    @abstractmethod
+    def stream_images(self, images: Iterable[OCRImage]) -> Iterator[OCRResult]:
+        """Yield one result per image as soon as it is done, in completion order."""
         pass
+
+    def stream_live(self, images: Iterable[OCRImage]) -> Iterator[OCRResult]:
+        """Like `stream_images`, but start on the first images while the caller is still producing the rest.
+
+        Engines that support batches are driven by a single-backend Scheduler; others wait for all images.
+        """
+        if not self.supports_batches:
+            return self.stream_images(images)
+
+        from scheduler import Scheduler
+
+        return Scheduler([self]).stream_live(images)
+
+    async def astream(self, images_dir: Path) -> AsyncIterator[OCRResult]:
+        iterator = self.stream(images_dir)
+        done = object()
+        while (result := await asyncio.to_thread(next, iterator, done)) is not done:
+            yield result
     
     @property
     @abstractmethod
     def engine_name(self) -> str:
         pass
 
+    @property
+    def supports_batches(self) -> bool:
+        """Whether the engine implements `process_batch` and can be driven by the scheduler."""
+        return False
+
+    @property
+    def concurrency(self) -> int:
+        """Number of `process_batch` calls the engine can keep in flight."""
+        return 1
+
+    @property
+    def chunk_size(self) -> int:
+        """Maximum number of images handled by one `process_batch` call."""
+        return 1
+
+    def process_batch(self, images: List[OCRImage]) -> Dict[str, str]:
+        """OCR a small group of images. Used by the scheduler to pull work from a shared queue.
+
+        Only called on engines with `supports_batches`. Images missing from the result are handed to other backends.
+        """
+        raise NotImplementedError(f"{self.engine_name} does not support scheduled processing")
+
+    def _collect(self, results: Iterator[OCRResult]) -> Dict[str, str]:
+        from utils import timecode_key
+
+        collected = {result.image_name: result.text for result in results}
+        return dict(sorted(collected.items(), key=timecode_key))
+
 class OCREngineType(Enum):
     GGLENS = "gglens"
     GEMINI = "gemini"
+    SCHEDULER = "scheduler"
+    ONNX = "onnx"
     
     @classmethod
     def from_string(cls, value: str):
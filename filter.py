@@ -1,190 +1,1029 @@
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from enum import Enum
-from os import rename
+from os import cpu_count
 from pathlib import Path
-from typing import Dict, List, Tuple
+from queue import Queue
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple, Set, Tuple
 
+import numpy as np
+from PIL import Image
 from vskernels import Bilinear
 from vsmasktools import HardsubLine
 from vspreview.api import is_preview
 from vsrgtools import box_blur
 from vssource import source
-from vstools import clip_async_render, depth, get_prop, get_w, get_y, iterate, merge_clip_props, set_output, vs
+from vstools import clip_async_render, depth, get_w, get_y, iterate, set_output, vs
+
+from detection import BAND_HEIGHT, BAND_WIDTH, DetectionSignal, band_changes, calibrate_thresholds, segment_events
+from engine import OCRImage
+from sync import SyncEstimate, estimate_offset
+from trim import to_gray, trim_image
+from utils import file_fingerprint
 
 core = vs.core
 
-class Location(str, Enum):
-    BOT = "bot"
-    TOP = "top"
+SUBTITLE_PROPS = ("psmAvg", "_SceneChangePrev", "_SceneChangeNext", "PrevDiff", "NextDiff")
+SCENE_CHANGE_THRESHOLD = 0.012
+
+# Events are exported from several threads, and picking a free image name must not race.
+_name_lock = Lock()
+
+class Region(NamedTuple):
+    """A named rectangle searched for subtitles, in fractions of the frame width and height.
+
+    `psm_threshold` overrides the psmAvg cut of the Filter for this region, `scene_threshold` is its SCDetect
+    threshold. The name prefixes exported images (`{name}_{timecode}.jpg`), so it must start with a letter and
+    contain no underscore.
+    """
+
+    name: str
+    left: float
+    top: float
+    right: float
+    bottom: float
+    psm_threshold: float | None = None
+    scene_threshold: float = SCENE_CHANGE_THRESHOLD
+
+    def crop(self, width: int, height: int) -> Dict[str, int]:
+        """std.Crop arguments for a `width` x `height` frame, kept even so 4:2:0 clips can be cut."""
+        return dict(
+            left=round(width * self.left) // 2 * 2,
+            right=(width - round(width * self.right)) // 2 * 2,
+            top=round(height * self.top) // 2 * 2,
+            bottom=(height - round(height * self.bottom)) // 2 * 2,
+        )
+
+    @classmethod
+    def from_string(cls, value: str, roi_width: float = 0.8):
+        """Parse `name`, `name:left,top,right,bottom` or `name:left,top,right,bottom:psm_threshold`.
+
+        A bare `bot` or `top` is the default region of that name for `roi_width`.
+        """
+        name, _, rest = value.partition(":")
+        if not name[:1].isalpha() or not name.isalnum():
+            raise ValueError(f"Region name must be alphanumeric and start with a letter: {name}")
+        if not rest:
+            for region in default_regions(roi_width):
+                if region.name == name:
+                    return region
+            raise ValueError(f"Unknown region: {name}. Give its rectangle as {name}:left,top,right,bottom")
+
+        box, _, threshold = rest.partition(":")
+        try:
+            left, top, right, bottom = (float(value) for value in box.split(","))
+        except ValueError:
+            raise ValueError(f"Region rectangle must be four fractions left,top,right,bottom: {box}")
+        if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+            raise ValueError(f"Region rectangle must lie inside the frame: {box}")
+        return cls(name, left, top, right, bottom, float(threshold) if threshold else None)
+
+
+def default_regions(roi_width: float = 0.8) -> List[Region]:
+    """The bottom and top fifth of the frame, inside the centered band where subtitles live."""
+    side = (1 - roi_width) / 2
+    edge = 20 / 720
+    return [
+        Region("bot", side, 0.8, 1 - side, 1 - edge),
+        Region("top", side, edge, 1 - side, 0.2),
+    ]
+
+class Dilation(str, Enum):
+    ITERATE = "iterate"
+    SEPARABLE = "separable"
+    DOWNSCALE = "downscale"
+
+    @classmethod
+    def from_string(cls, value: str):
+        for dilation in cls:
+            if dilation.value.lower() == value.lower():
+                return dilation
+        raise ValueError(f"Unknown dilation: {value}. Available: {[d.value for d in cls]}")
 
 class Filter:
+    STREAM_WINDOW: int = 1000
+    CACHE_VERSION: int = 1
+    CACHE_ENTRIES: int = 8
+    BAND_THRESHOLD: int = 8
+    INCREMENTAL_MARGIN: int = 24
+    SYNC_WINDOWS: int = 5
+    SYNC_WINDOW: int = 240
+    SYNC_MIN_SCORE: float = 0.3
+
     def __init__(
-        self, clean_path: str | Path, clean_offset: int, hardsub_path: str | Path, sub_offset: int, images_dir: Path
+        self,
+        clean_path: str | Path,
+        clean_offset: int,
+        hardsub_path: str | Path,
+        sub_offset: int,
+        images_dir: Path,
+        signal_path: Path | None = None,
+        reuse_signal: bool = False,
+        psm_threshold: float = 0.9,
+        min_duration: int = 0,
+        merge_gap: int = 0,
+        dilation: Dilation | str = Dilation.SEPARABLE,
+        detect_height: int = 360,
+        coarse_step: int = 1,
+        roi_width: float = 0.8,
+        discover_samples: int = 0,
+        regions: List[Region | str] | None = None,
+        workers: int = 1,
+        in_memory: bool = False,
+        save_images: bool = False,
+        trim: bool = True,
+        trim_pad: int = 8,
+        grayscale: bool = False,
+        sync_search: int = 0,
+        auto_threshold: bool = False,
+        cache: bool = True,
+        incremental: bool = False,
     ):
         self.clean_path: str | Path = clean_path
         self.clean_offset: int = clean_offset
         self.hardsub_path: str | Path = hardsub_path
         self.sub_offset: int = sub_offset
         self.images_dir: Path = images_dir
+        # The signal is kept outside images_dir, which is wiped before every run.
+        self.signal_path: Path = signal_path if signal_path is not None else images_dir.parent / "signal.npz"
+        self.reuse_signal: bool = reuse_signal
+        self.psm_threshold: float = psm_threshold
+        self.min_duration: int = min_duration
+        self.merge_gap: int = merge_gap
+        self.dilation: Dilation = Dilation.from_string(dilation) if isinstance(dilation, str) else dilation
+        self.detect_height: int = detect_height
+        self.coarse_step: int = coarse_step
+        self.roi_width: float = roi_width
+        self.discover_samples: int = discover_samples
+        self.regions: List[Region] = (
+            [Region.from_string(region, roi_width) if isinstance(region, str) else region for region in regions]
+            if regions
+            else default_regions(roi_width)
+        )
+        if len({region.name for region in self.regions}) != len(self.regions):
+            raise ValueError(f"Region names must be unique: {[region.name for region in self.regions]}")
+        self.workers: int = workers
+        # In memory, the RGB crops go straight to OCR and JPEGs are only written as a debug artifact.
+        self.in_memory: bool = in_memory
+        self.save_images: bool = save_images or not in_memory
+        self.image_names: Set[str] = set()
+        self.trim: bool = trim
+        self.trim_pad: int = trim_pad
+        self.grayscale: bool = grayscale
+        # Offsets are searched once, in the first _build_graph; worker processes reuse the result.
+        self.sync_search: int = sync_search
+        self.synced: bool = sync_search <= 0
+        self.auto_threshold: bool = auto_threshold
+        # Exported images are kept per source fingerprint and settings, next to the signal.
+        self.cache: bool = cache
+        self.cache_dir: Path = self.signal_path.parent / "filter_cache"
+        self.exported: List[Tuple[int, int, str, OCRImage]] = []
+        # With `incremental`, events whose hardsub bands did not change since the last run take their text from
+        # `previous_texts` (image name to OCR text, set by the caller) instead of being exported again.
+        self.incremental: bool = incremental
+        self.previous_texts: Dict[str, str] = {}
+        self.reused_texts: Dict[str, str] = {}
+        # Set by _build_graph; region discovery may drop regions without subtitles. The crops are kept so worker
+        # processes rebuild the same graph without discovering again.
+        self.active_regions: List[Region] = list(self.regions)
+        self.region_crops: Dict[str, Dict[str, int]] | None = None
+        # Clean-side clips by what they were derived with; MultiFilter hands one dict to all of its Filters.
+        self.clean_clips: Dict[str, vs.VideoNode] = {}
+        self.band_clip: vs.VideoNode | None = None
 
-    def filter_videos(self):
-        clean = source(self.clean_path)[self.clean_offset :]
-        hardsub = source(self.hardsub_path)[self.sub_offset :]
+    def __getstate__(self) -> Dict:
+        # VapourSynth nodes cannot be pickled; segment workers build their own clips.
+        return {**self.__dict__, "clean_clips": {}, "band_clip": None}
+
+    def filter_videos(self, images: "Queue[OCRImage | None] | None" = None) -> List[OCRImage]:
+        """Detect and export subtitle images, returning them for OCR.
+
+        With an `images` queue, every exported image is put on it as soon as its event is final, followed by None
+        once the episode is done, so OCR can run while the rest of the episode is still rendering. The None is put
+        even when filtering fails, so the consumer never waits on a queue that will not be filled.
+        """
+        self.image_names = set()
+        self.exported = []
+        self.reused_texts = {}
+        if images is None:
+            return self._filter_videos(None)
+        try:
+            return self._filter_videos(images)
+        finally:
+            images.put(None)
+
+    def _filter_videos(self, images: "Queue[OCRImage | None] | None") -> List[OCRImage]:
+        cache_key = self._cache_key() if self.cache and not is_preview() else None
+        if cache_key is not None:
+            cached = self._load_cache(cache_key)
+            if cached is not None and images is not None:
+                for image in cached:
+                    images.put(image)
+                return []
+            if cached is not None:
+                return cached
+
+        clean, hardsub, subtitles, merge_props, masks = self._build_graph()
+
+        if is_preview():
+            for name, subtitle_clip in subtitles.items():
+                set_output(subtitle_clip, name)
+            set_output(hardsub, "sub")
+            set_output(clean, "clean")
+            set_output(merge_props, "diff")
+            # set_output(diff, "diff")
+            return []
+        
+        writers = {name: self._build_writer(clip, name) for name, clip in subtitles.items()}
+
+        signal = self._load_signal(merge_props)
+        if images is not None:
+            if self.auto_threshold or self.incremental:
+                print("Threshold calibration and incremental runs need the whole signal, not used while streaming.")
+            if self.coarse_step > 1 or self.workers > 1:
+                print("Streaming renders the episode in order in one process; --coarse-step and --workers are not used.")
+            if signal is None:
+                signal = self._stream_events(merge_props, writers, images)
+                signal.save(self.signal_path)
+            else:
+                self._emit_events(signal, signal.num_frames, set(), writers, images)
+            if cache_key is not None:
+                self._save_cache(cache_key)
+            return []
+
+        changed = None
+        if signal is None and self.incremental and self.previous_texts:
+            rerendered = self._rerender_changes(merge_props)
+            if rerendered is not None:
+                signal, changed = rerendered
+                signal.save(self.signal_path)
+                # The cache would only hold the images exported now, not the events reused from the last run.
+                cache_key = None
+        if signal is None:
+            if self.coarse_step > 1:
+                signal = self._get_props_coarse(masks, self.coarse_step)
+            elif self.workers > 1:
+                signal = self._get_props_parallel(merge_props, self.workers)
+            else:
+                signal = self._get_props(merge_props)
+            signal.save(self.signal_path)
+        return self._export_signal(signal, writers, cache_key, changed)
+
+    def _export_signal(
+        self,
+        signal: DetectionSignal,
+        writers: Dict[str, vs.VideoNode],
+        cache_key: str | None,
+        changed: np.ndarray | None = None,
+    ) -> List[OCRImage]:
+        """Segment a complete signal, export its events and keep them under `cache_key`.
+
+        With a per-frame `changed` mask, events that lie entirely in unchanged frames and were OCRed before are put
+        in `reused_texts` instead of being exported.
+        """
+        psm_thresholds = self._psm_thresholds()
+        if self.auto_threshold:
+            signal, psm_thresholds = self._calibrate(signal)
+        scene_changes = self._get_scene_changes(signal, psm_thresholds)
+        if changed is not None:
+            scene_changes = self._reuse_unchanged(scene_changes, changed, signal.fps_num, signal.fps_den)
+        exported = self._export_events(scene_changes, writers, signal.fps_num, signal.fps_den)
+        if cache_key is not None:
+            self._save_cache(cache_key)
+        return exported
+
+    def _rerender_changes(self, merge_props: vs.VideoNode) -> Tuple[DetectionSignal, np.ndarray] | None:
+        """Render again only the frames whose hardsub bands differ from the signal of the previous run.
+
+        The bands of the new upload are fingerprinted in a quick pass that decodes only the hardsub. Returns the
+        previous signal with the changed ranges replaced and the per-frame mask of those ranges, or None when the
+        episode has to be rendered in full.
+        """
+        if not self.signal_path.exists():
+            return None
+        try:
+            previous = DetectionSignal.load(self.signal_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cannot read the previous detection signal {self.signal_path}, rendering everything: {e}")
+            return None
+        names = [region.name for region in self.active_regions]
+        if not previous.matches(merge_props.num_frames, names, merge_props.fps_num, merge_props.fps_den):
+            print("The previous detection signal does not match this upload, rendering everything.")
+            return None
+        if not previous.frames["band"].any():
+            print("The previous detection signal has no band fingerprints, rendering everything.")
+            return None
+
+        changed = band_changes(previous.frames["band"], self._render_bands(), self.BAND_THRESHOLD)
+        # Frames around a change are rendered again too, so scene changes and merged events next to it are redone.
+        margin = self.INCREMENTAL_MARGIN + self.merge_gap
+        changed = np.convolve(changed, np.ones(2 * margin + 1), mode="same") > 0
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], changed.astype(np.int8), [0]))))
+        ranges = [(int(start), int(end)) for start, end in zip(edges[::2], edges[1::2])]
+        print(f"{int(changed.sum())} of {len(changed)} frames changed in {len(ranges)} ranges, rendering only those.")
+
+        signal = DetectionSignal(previous.frames.copy(), previous.locations, previous.fps_num, previous.fps_den)
+        for start, end in ranges:
+            # Ranges are trimmed from the full graph, so scene changes at their edges see the neighbouring frames.
+            rendered = self._get_props(merge_props[start:end], f"Detecting subtitles in frames {start}-{end - 1}...")
+            signal.frames[start:end] = rendered.frames
+        return (signal, changed)
+
+    def _render_bands(self) -> np.ndarray:
+        """Return the (frames, regions, pixels) band thumbnails of the hardsub, without rendering any mask."""
+        assert self.band_clip is not None
+        regions = len(self.active_regions)
+        bands = np.zeros((self.band_clip.num_frames, regions, BAND_WIDTH * BAND_HEIGHT), dtype=np.uint8)
+
+        def _record(n: int, f: vs.VideoFrame) -> None:
+            bands[n] = np.asarray(f[0]).reshape(regions, -1)
+
+        clip_async_render(self.band_clip, None, "Fingerprinting subtitle bands...", _record)
+        return bands
+
+    def _reuse_unchanged(
+        self, scene_changes: List[Tuple[int, int, str]], changed: np.ndarray, fpsnum: int, fpsden: int
+    ) -> List[Tuple[int, int, str]]:
+        """Move the events outside `changed` frames that have a previous text to `reused_texts`; return the rest."""
+        touched = np.concatenate(([0], np.cumsum(changed)))
+        remaining: List[Tuple[int, int, str]] = []
+        for start, end, name in scene_changes:
+            image_name = f"{name}_{self._format_frame_time(start, end, fpsnum, fpsden)}.jpg"
+            if touched[end + 1] - touched[start] == 0 and image_name in self.previous_texts:
+                self.reused_texts[image_name] = self.previous_texts[image_name]
+                with _name_lock:
+                    self.image_names.add(image_name)
+            else:
+                remaining.append((start, end, name))
+        print(f"Reusing the text of {len(self.reused_texts)} unchanged events, exporting {len(remaining)}.")
+        return remaining
+
+    def _cache_key(self) -> str:
+        """Hash everything the exported images depend on: both sources, the offsets and the filter settings."""
+        settings = {
+            "version": self.CACHE_VERSION,
+            "filter": type(self).__name__,
+            "clean": file_fingerprint(self.clean_path),
+            "hardsub": file_fingerprint(self.hardsub_path),
+            "offsets": [self.clean_offset, self.sub_offset, self.sync_search],
+            "psm_threshold": self.psm_threshold,
+            "min_duration": self.min_duration,
+            "merge_gap": self.merge_gap,
+            "dilation": self.dilation.value,
+            "detect_height": self.detect_height,
+            "coarse_step": self.coarse_step,
+            "discover_samples": self.discover_samples,
+            "regions": [list(region) for region in self.regions],
+            "trim": [self.trim, self.trim_pad, self.grayscale],
+            "auto_threshold": self.auto_threshold,
+        }
+        return hashlib.blake2b(json.dumps(settings, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def _load_cache(self, key: str) -> List[OCRImage] | None:
+        entry = self.cache_dir / key
+        try:
+            events = json.loads((entry / "events.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Cannot read filter cache {entry}, rendering again: {e}")
+            return None
+        if not all((entry / event["image"]).exists() for event in events):
+            print(f"Filter cache {entry} is missing images, rendering again.")
+            return None
+
+        print(f"Reusing {len(events)} subtitle images from {entry}, nothing changed since they were exported.")
+        # Touching the entry keeps it among the most recently used ones when the cache is pruned.
+        entry.touch()
+        images: List[OCRImage] = []
+        for event in events:
+            path = entry / event["image"]
+            if self.save_images:
+                path = Path(shutil.copyfile(path, self.images_dir / event["image"]))
+            images.append(OCRImage(event["image"], path))
+        return images
+
+    def _save_cache(self, key: str) -> None:
+        """Store the exported images and their events under `key`; a partly written entry is never visible."""
+        entry = self.cache_dir / key
+        staging = self.cache_dir / f"{key}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        events = []
+        for start, end, region, image in sorted(self.exported, key=lambda event: (event[0], event[2])):
+            if isinstance(image.data, Path):
+                shutil.copyfile(image.data, staging / image.name)
+            else:
+                Image.fromarray(image.data).save(staging / image.name, quality=90)
+            events.append({"start": start, "end": end, "region": region, "image": image.name})
+        (staging / "events.json").write_text(json.dumps(events, indent=1), encoding="utf-8")
+
+        shutil.rmtree(entry, ignore_errors=True)
+        staging.rename(entry)
+        self._prune_cache()
+
+    def _prune_cache(self) -> None:
+        """Keep only the `CACHE_ENTRIES` most recently used entries; older sources and settings are dropped."""
+        entries = [path for path in self.cache_dir.iterdir() if path.is_dir() and path.suffix != ".tmp"]
+        entries.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+        for entry in entries[self.CACHE_ENTRIES :]:
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def _build_graph(
+        self,
+    ) -> Tuple[vs.VideoNode, vs.VideoNode, Dict[str, vs.VideoNode], vs.VideoNode, Dict[str, vs.VideoNode]]:
+        """Return the prepared clean and hardsub clips, the per-region diffs, the merged props clip and the
+        per-region detection masks, keyed by region name."""
+        clean, hardsub = self._load_sources()
+        clean_key = f"{self.clean_offset}:{clean.num_frames}:{clean.width}x{clean.height}"
+
+        # Detection only needs a yes/no signal, so it runs on a smaller luma pair than the exported diff.
+        detect_hardsub = get_y(hardsub)
+        detect_width, detect_height = hardsub.width, hardsub.height
+        if self.detect_height < hardsub.height:
+            detect_width, detect_height = get_w(self.detect_height, hardsub), self.detect_height
+            detect_hardsub = Bilinear().scale(detect_hardsub, detect_width, detect_height)
+        detect_clean = self._clean_clip(
+            f"detect:{clean_key}:{detect_height}",
+            lambda: get_y(clean)
+            if detect_height == clean.height
+            else Bilinear().scale(get_y(clean), detect_width, detect_height),
+        )
+        detect_scale = detect_hardsub.height / hardsub.height
+
+        # Every region is cropped before any mask work, and all of them share one decode of both sources.
+        if self.region_crops is None:
+            crops = {region.name: region.crop(hardsub.width, hardsub.height) for region in self.regions}
+            if self.discover_samples > 0:
+                crops = self._discover_regions(detect_clean, detect_hardsub, crops, detect_scale)
+            self.region_crops = crops
+        crops = self.region_crops
+        self.active_regions = [region for region in self.regions if region.name in crops]
+
+        subtitles: Dict[str, vs.VideoNode] = {}
+        masks: Dict[str, vs.VideoNode] = {}
+        detections: Dict[str, vs.VideoNode] = {}
+        bands: List[vs.VideoNode] = []
+        for region in self.active_regions:
+            crop = crops[region.name]
+            detect_crop = {side: round(value * detect_scale) for side, value in crop.items()}
+            bands.append(Bilinear().scale(detect_hardsub.std.Crop(**detect_crop), BAND_WIDTH, BAND_HEIGHT))
+            crop_key = ",".join(f"{side}={value}" for side, value in sorted(crop.items()))
+            masks[region.name] = self._get_mask(
+                self._clean_clip(
+                    f"detect_blur:{clean_key}:{detect_height}:{crop_key}",
+                    lambda: box_blur(detect_clean.std.Crop(**detect_crop)),
+                ),
+                detect_hardsub.std.Crop(**detect_crop),
+                max(1, round(10 * detect_scale)),
+            )
+            detections[region.name] = self._detect(masks[region.name], region.scene_threshold)
+            subtitles[region.name] = self._get_subtitles(
+                self._clean_clip(f"crop:{clean_key}:{crop_key}", lambda: clean.std.Crop(**crop)),
+                hardsub.std.Crop(**crop),
+                detections[region.name],
+            )
+
+        # The props are carried by small thumbnails of the hardsub bands, shrunk from the detection-size hardsub
+        # crops, so every rendered frame also records what the subtitles looked like for a later incremental run.
+        # The props themselves come from the detection-size masks; the full-size diffs are only rendered for
+        # exported frames.
+        self.band_clip = core.std.StackVertical(bands)
+        merge_props = self._merge_props(self.band_clip, detections, self._subtitle_props())
+        return (clean, hardsub, subtitles, merge_props, masks)
+
+    def _load_sources(self) -> Tuple[vs.VideoNode, vs.VideoNode]:
+        """Return the synced clean and hardsub clips at the same size, 8-bit, at most 720p and of equal length."""
+        clean_source = self._clean_clip("source", lambda: source(self.clean_path))
+        hardsub = source(self.hardsub_path)
+        if not self.synced:
+            self._sync_offsets(clean_source, hardsub)
+            self.synced = True
+        hardsub = hardsub[self.sub_offset :]
 
         if hardsub.height > 720:
             hardsub = Bilinear().scale(hardsub, width=get_w(720, hardsub), height=720)
-        if clean.width != hardsub.width or clean.height != hardsub.height:
-            clean = Bilinear().scale(clean, hardsub.width, hardsub.height)
-        clean = depth(clean, 8)
         hardsub = depth(hardsub, 8)
-        
-        if hardsub.num_frames != clean.num_frames:
-            min_frames = min(hardsub.num_frames, clean.num_frames)
-            hardsub = hardsub[:min_frames]
-            clean = clean[:min_frames]
+        num_frames = min(hardsub.num_frames, clean_source.num_frames - self.clean_offset)
+        hardsub = hardsub[:num_frames]
 
-        sub_height = hardsub.height - (hardsub.height / 5)
-        sub_vert = 20
+        def _prepare_clean() -> vs.VideoNode:
+            clean = clean_source[self.clean_offset : self.clean_offset + num_frames]
+            if clean.width != hardsub.width or clean.height != hardsub.height:
+                clean = Bilinear().scale(clean, hardsub.width, hardsub.height)
+            return depth(clean, 8)
 
-        bot_clean = clean.std.Crop(bottom=sub_vert, top=sub_height)
-        bot_hardsub = hardsub.std.Crop(bottom=sub_vert, top=sub_height)
+        clean = self._clean_clip(f"{self.clean_offset}:{num_frames}:{hardsub.width}x{hardsub.height}", _prepare_clean)
+        return (clean, hardsub)
 
-        top_clean = clean.std.Crop(bottom=sub_height, top=sub_vert)
-        top_hardsub = hardsub.std.Crop(bottom=sub_height, top=sub_vert)
+    def _clean_clip(self, key: str, build: Callable[[], vs.VideoNode]) -> vs.VideoNode:
+        """Return the clean-side clip `key`, built once for every Filter sharing `clean_clips` with this one."""
+        if key not in self.clean_clips:
+            self.clean_clips[key] = build()
+        return self.clean_clips[key]
 
-        bot_subtitles = self._get_subtitles(bot_clean, bot_hardsub)
-        bot_subtitles = self._props_rename(bot_subtitles, Location.BOT)
+    def _sync_offsets(self, clean: vs.VideoNode, hardsub: vs.VideoNode) -> SyncEstimate | None:
+        """Search `sync_search` frames around the given offsets for the one that lines the sources up.
 
-        top_subtitles = self._get_subtitles(top_clean, top_hardsub)
-        top_subtitles = self._props_rename(top_subtitles, Location.TOP)
-        
-        blank = hardsub.std.BlankClip(format=hardsub.format.id, keep=True)
-        merge_props = merge_clip_props(blank, bot_subtitles, top_subtitles)
+        A few windows of consecutive frames spread over the hardsub are compared with the clean frames around them
+        through tiny luma thumbnails, and `clean_offset`/`sub_offset` are replaced when the match is clear.
+        """
+        base = self.clean_offset - self.sub_offset
+        search = self.sync_search
+        first = max(search - base, 0)
+        last = min(hardsub.num_frames, clean.num_frames - base - search) - self.SYNC_WINDOW
+        if last <= first:
+            print(f"Sources are too short to search offsets {base - search} to {base + search}, keeping {base}")
+            return None
 
-        if is_preview():
-            set_output(
-                top_subtitles,
-                "top",
+        starts = np.linspace(first, last, self.SYNC_WINDOWS).astype(int)
+        hardsub_windows = self._thumbnails(hardsub, [(start, start + self.SYNC_WINDOW) for start in starts])
+        clean_windows = self._thumbnails(
+            clean, [(start + base - search, start + base + self.SYNC_WINDOW + search) for start in starts]
+        )
+        estimate = estimate_offset(hardsub_windows, clean_windows, base, search)
+
+        if estimate.score < self.SYNC_MIN_SCORE:
+            print(f"No clear offset between the sources (score {estimate.score:.2f}), keeping {base}")
+            return estimate
+        if estimate.drift > 1:
+            print(
+                f"Warning: the sources drift, window offsets {estimate.window_offsets}; "
+                + f"using {estimate.offset} for the whole episode"
             )
-            set_output(
-                bot_subtitles,
-                "bot",
+        self.clean_offset, self.sub_offset = (estimate.offset, 0) if estimate.offset >= 0 else (0, -estimate.offset)
+        print(
+            f"Detected offset {estimate.offset} (score {estimate.score:.2f}): "
+            + f"clean offset {self.clean_offset}, hardsub offset {self.sub_offset}"
+        )
+        return estimate
+
+    def _thumbnails(self, clip: vs.VideoNode, ranges: List[Tuple[int, int]]) -> List[np.ndarray]:
+        """Render (frames, pixels) luma thumbnails of every frame range in one pass."""
+        thumbnails = Bilinear().scale(get_y(depth(clip, 8)), 32, 18)
+        # Subtitles sit in the top and bottom rows, so only the middle of the picture is compared.
+        thumbnails = thumbnails.std.Crop(top=4, bottom=4)
+        spliced = core.std.Splice([thumbnails[start:end] for start, end in ranges])
+        pixels = np.zeros((spliced.num_frames, thumbnails.width * thumbnails.height), dtype=np.uint8)
+
+        def _record(n: int, f: vs.VideoFrame) -> None:
+            pixels[n] = np.asarray(f[0]).ravel()
+
+        clip_async_render(spliced, None, f"Fingerprinting {spliced.num_frames} frames for sync...", _record)
+        bounds = np.cumsum([0] + [end - start for start, end in ranges])
+        return [pixels[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def _discover_regions(
+        self,
+        detect_clean: vs.VideoNode,
+        detect_hardsub: vs.VideoNode,
+        crops: Dict[str, Dict[str, int]],
+        detect_scale: float,
+    ) -> Dict[str, Dict[str, int]]:
+        """Mask a few frames spread over the episode and keep only the regions, and rows, where subtitles appear.
+
+        `crops` are std.Crop arguments in export pixels per region name. A region without mask rows in enough samples
+        is dropped and the others are tightened vertically to the observed rows plus some padding.
+        """
+        step = max(1, detect_hardsub.num_frames // self.discover_samples)
+        mask = self._discovery_mask(detect_clean[::step], detect_hardsub[::step])
+        boxes = {
+            name: (
+                round(crop["top"] * detect_scale),
+                mask.height - round(crop["bottom"] * detect_scale),
+                round(crop["left"] * detect_scale),
+                mask.width - round(crop["right"] * detect_scale),
             )
-            set_output(hardsub, "sub")
-            set_output(clean, "clean")
-            set_output(merge_props, "diff")
-            # set_output(diff, "diff")
-            return
-        
-        rendered_props = self._get_props(merge_props)
-        scene_changes = self._get_scene_changes(rendered_props, bot_subtitles, top_subtitles)
-        self._rename_images(scene_changes, hardsub.fps_num, hardsub.fps_den)
+            for name, crop in crops.items()
+        }
+        # One row per sample, so callbacks running on several VapourSynth threads never write the same cells.
+        frame_hits = {
+            name: np.zeros((mask.num_frames, bottom - top), dtype=np.bool_)
+            for name, (top, bottom, _, _) in boxes.items()
+        }
+
+        def _record(n: int, f: vs.VideoFrame) -> None:
+            # A row counts when a visible share of it is text edges, so compression noise does not light it up.
+            text = np.asarray(f[0]) > 0
+            for name, (top, bottom, left, right) in boxes.items():
+                frame_hits[name][n] = text[top:bottom, left:right].mean(axis=1) > 0.02
+
+        clip_async_render(mask, None, f"Discovering subtitle regions ({mask.num_frames} samples)...", _record)
+        row_hits = {name: hits.sum(axis=0) for name, hits in frame_hits.items()}
+
+        height = round(mask.height / detect_scale)
+        min_hits = max(2, mask.num_frames // 100)
+        discovered: Dict[str, Dict[str, int]] = {}
+        for name, crop in crops.items():
+            rows = (np.flatnonzero(row_hits[name] >= min_hits) + boxes[name][0]) / detect_scale
+            if rows.size == 0:
+                print(f"No subtitles found in {name} region, skipping it")
+                continue
+            pad = max(8, int((rows[-1] - rows[0]) / 10))
+            # Crops stay even so 4:2:0 clips can be cut.
+            band_top = max(crop["top"], int(rows[0]) - pad) // 2 * 2
+            band_bottom = max(crop["bottom"], height - int(rows[-1]) - 1 - pad) // 2 * 2
+            discovered[name] = {**crop, "top": band_top, "bottom": band_bottom}
+            print(f"{name} region: rows {band_top} to {height - band_bottom}")
+
+        if not discovered:
+            print("Region discovery found no subtitles, keeping all regions")
+            return crops
+        return discovered
+
+    def _merge_props(
+        self, clip: vs.VideoNode, subtitles: Dict[str, vs.VideoNode], props: Tuple[str, ...] = SUBTITLE_PROPS
+    ) -> vs.VideoNode:
+        """Copy `props` of each region clip onto `clip` as `{name}{prop}`.
+
+        akarin.PropExpr does the renaming natively, so no Python callback runs per frame.
+        """
+        for name, subtitle_clip in subtitles.items():
+            clip = core.akarin.PropExpr(
+                [clip, subtitle_clip],
+                lambda name=name: {f"{name}{prop}": f"y.{prop}" for prop in props},
+            )
+        return clip
+
+    def _discovery_mask(self, detect_clean_y: vs.VideoNode, detect_hardsub_y: vs.VideoNode) -> vs.VideoNode:
+        """Undilated text mask of sampled frames for region discovery."""
+        return HardsubLine().get_mask(box_blur(detect_hardsub_y), box_blur(detect_clean_y))
 
-    def _props_rename(self, clip: vs.VideoNode, location: Location) -> vs.VideoNode:
-        def _rename(n, f):
-            f = f.copy()
-            for prop in f.props:
-                f.props[f"{location.value}{prop}"] = f.props[prop]
-                del f.props[prop]
-            return f
-        return clip.std.ModifyFrame(clip, _rename)
+    def _get_mask(self, detect_clean_y: vs.VideoNode, detect_hardsub_y: vs.VideoNode, radius: int) -> vs.VideoNode:
+        """`detect_clean_y` comes blurred from `_build_graph`, so Filters sharing a clean source blur it once."""
+        mask = HardsubLine().get_mask(box_blur(detect_hardsub_y), detect_clean_y)
+        return self._dilate(mask, radius)
 
+    def _detect(self, mask: vs.VideoNode, scene_threshold: float) -> vs.VideoNode:
+        """Tag the detection mask with the scene change and average props the signal is recorded from."""
+        mask = mask.misc.SCDetect(scene_threshold)
+        if self.auto_threshold:
+            # The differences SCDetect cuts are kept too, so its threshold can be calibrated on a rendered signal.
+            mask = core.std.PlaneStats(mask, mask[0] + mask[:-1], prop="Prev")
+            mask = core.std.PlaneStats(mask, mask[1:] + mask[-1], prop="Next")
+        return mask.vszip.PlaneAverage([0])
 
-    def _get_subtitles(self, clean: vs.VideoNode, hardsub: vs.VideoNode) -> vs.VideoNode:
-        clean_y = get_y(clean)
-        hardsub_y = get_y(hardsub)
+    def _subtitle_props(self) -> Tuple[str, ...]:
+        """The props `_detect` sets; the scene differences are only measured for threshold calibration."""
+        return SUBTITLE_PROPS if self.auto_threshold else SUBTITLE_PROPS[:3]
 
-        mask = HardsubLine().get_mask(box_blur(hardsub_y), box_blur(clean_y))
-        mask = iterate(mask, core.std.Maximum, 10).misc.SCDetect(0.012).vszip.PlaneAverage([0])
+    def _get_subtitles(self, clean: vs.VideoNode, hardsub: vs.VideoNode, mask: vs.VideoNode) -> vs.VideoNode:
+        """The exported picture: subtitle pixels inside the upscaled detection `mask`, blank elsewhere."""
+        export_mask = mask
+        if mask.width != hardsub.width or mask.height != hardsub.height:
+            export_mask = Bilinear().scale(mask, hardsub.width, hardsub.height)
 
         blank = hardsub.std.BlankClip(format=hardsub.format.id, keep=True)
-        merge = blank.std.MaskedMerge(hardsub.std.MakeDiff(clean), mask)
+        merge = blank.std.MaskedMerge(self._subtitle_pixels(clean, hardsub), export_mask)
         return merge.std.CopyFrameProps(mask)
 
-    def _get_props(self, clip: vs.VideoNode) -> List[Dict[str, int | float]]:
-        return clip_async_render(
-            clip, 
-            None, 
-            'Detecting subtitles...', 
-            lambda n, f: {
-                f"{loc.value}{suffix}": get_prop(f, f"{loc.value}{suffix}", float if suffix == "psmAvg" else int)
-                for loc in Location 
-                for suffix in ["psmAvg", "_SceneChangePrev", "_SceneChangeNext"]
-            }
+    def _subtitle_pixels(self, clean: vs.VideoNode, hardsub: vs.VideoNode) -> vs.VideoNode:
+        """The picture exported inside the mask: the difference of the hardsub against the clean source."""
+        return hardsub.std.MakeDiff(clean)
+
+    def _dilate(self, mask: vs.VideoNode, radius: int) -> vs.VideoNode:
+        """Grow the mask by `radius` pixels in every direction, like `radius` passes of std.Maximum."""
+        if self.dilation == Dilation.SEPARABLE:
+            # Repeated 3x3 maximums equal one (2 * radius + 1) square maximum, which splits into two 1D passes.
+            horizontal = " ".join(f"x[{d},0]" for d in range(-radius, radius + 1)) + " max" * (2 * radius)
+            vertical = " ".join(f"x[0,{d}]" for d in range(-radius, radius + 1)) + " max" * (2 * radius)
+            return mask.akarin.Expr(horizontal).akarin.Expr(vertical)
+
+        if self.dilation == Dilation.DOWNSCALE:
+            # One 3x3 maximum before taking every second pixel keeps every mask pixel at half resolution.
+            half = mask.std.Maximum().resize.Point((mask.width + 1) // 2, (mask.height + 1) // 2)
+            half = iterate(half, core.std.Maximum, max(1, (radius - 1) // 2))
+            return half.resize.Point(mask.width, mask.height)
+
+        return iterate(mask, core.std.Maximum, radius)
+
+    def _get_props(self, clip: vs.VideoNode, progress: str | None = "Detecting subtitles...") -> DetectionSignal:
+        signal, record = self._props_recorder(clip)
+        clip_async_render(clip, None, progress, lambda n, f: record(n, f.props, np.asarray(f[0])))
+        return signal
+
+    def _props_recorder(
+        self, clip: vs.VideoNode, prefix: str = ""
+    ) -> Tuple[DetectionSignal, Callable[[int, vs.FrameProps, np.ndarray | None], None]]:
+        """Return an empty signal for `clip` and a callback that fills frame n from the `{prefix}{region}` props and,
+        when given, the stacked band thumbnails the props are carried on."""
+        names = [region.name for region in self.active_regions]
+        signal = DetectionSignal.empty(clip.num_frames, names, clip.fps_num, clip.fps_den)
+        psm = signal.frames["psmAvg"]
+        scene_change_prev = signal.frames["scene_change_prev"]
+        scene_change_next = signal.frames["scene_change_next"]
+        scene_diff_prev = signal.frames["scene_diff_prev"]
+        scene_diff_next = signal.frames["scene_diff_next"]
+        band = signal.frames["band"]
+
+        def _record(n: int, props: vs.FrameProps, bands: np.ndarray | None) -> None:
+            if bands is not None:
+                band[n] = bands.reshape(len(names), -1)
+            # PropExpr may store integer flags as floats, so read the raw values instead of using get_prop.
+            for i, name in enumerate(names):
+                name = f"{prefix}{name}"
+                psm[n, i] = props.get(f"{name}psmAvg", 0)
+                scene_change_prev[n, i] = props.get(f"{name}_SceneChangePrev", 0) == 1
+                scene_change_next[n, i] = props.get(f"{name}_SceneChangeNext", 0) == 1
+                scene_diff_prev[n, i] = props.get(f"{name}PrevDiff", np.nan)
+                scene_diff_next[n, i] = props.get(f"{name}NextDiff", np.nan)
+
+        return (signal, _record)
+
+    def _get_props_parallel(self, clip: vs.VideoNode, workers: int) -> DetectionSignal:
+        """Render the signal in frame segments spread over `workers` processes and stitch them together.
+
+        Every process builds the graph on its own VapourSynth core, so decoding and filtering scale past the limits
+        of a single core. Segments are trimmed from the full graph, so scene changes at segment edges still compare
+        against the neighbouring frames.
+        """
+        names = [region.name for region in self.active_regions]
+        signal = DetectionSignal.empty(clip.num_frames, names, clip.fps_num, clip.fps_den)
+        # More segments than workers, so a process that finishes early picks up another one.
+        bounds = np.linspace(0, clip.num_frames, workers * 4 + 1).astype(np.int64)
+        segments = [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        threads = max(1, (cpu_count() or 1) // workers)
+
+        print(f"Detecting subtitles in {len(segments)} segments on {workers} processes...")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            # VapourSynth cores do not survive a fork.
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_segment_worker,
+            initargs=(self, threads),
+        ) as executor:
+            futures = {executor.submit(_render_segment, start, end): (start, end) for start, end in segments}
+            for done, future in enumerate(as_completed(futures), 1):
+                start, end = futures[future]
+                signal.frames[start:end] = future.result()
+                print(f"Segment {done}/{len(segments)} done (frames {start}-{end - 1})")
+        return signal
+
+    def _stream_events(
+        self, clip: vs.VideoNode, writers: Dict[str, vs.VideoNode], images: "Queue[OCRImage | None]"
+    ) -> DetectionSignal:
+        """Render the signal `STREAM_WINDOW` frames at a time and export every event as soon as it is final."""
+        names = [region.name for region in self.active_regions]
+        signal = DetectionSignal.empty(clip.num_frames, names, clip.fps_num, clip.fps_den)
+        emitted: Set[Tuple[int, int, int]] = set()
+
+        print(f"Detecting subtitles in windows of {self.STREAM_WINDOW} frames, streaming images to OCR...")
+        for start in range(0, clip.num_frames, self.STREAM_WINDOW):
+            end = min(clip.num_frames, start + self.STREAM_WINDOW)
+            signal.frames[start:end] = self._get_props(clip[start:end], None).frames
+            self._emit_events(signal, end, emitted, writers, images)
+        return signal
+
+    def _emit_events(
+        self,
+        signal: DetectionSignal,
+        rendered: int,
+        emitted: Set[Tuple[int, int, int]],
+        writers: Dict[str, vs.VideoNode],
+        images: "Queue[OCRImage | None]",
+    ) -> None:
+        """Export the events among the first `rendered` frames that later frames cannot change."""
+        prefix = DetectionSignal(signal.frames[:rendered], signal.locations, signal.fps_num, signal.fps_den)
+        thresholds = np.asarray(self._psm_thresholds(), dtype=np.float32)
+        events = segment_events(prefix, thresholds, self.min_duration, self.merge_gap)
+        if rendered < signal.num_frames:
+            # An event may still merge with one that starts within merge_gap frames after it, so it is final only
+            # once those frames are rendered and none of them opens an event that has not ended yet.
+            events = events[events["end"] < rendered - self.merge_gap]
+            starts = (prefix.frames["psmAvg"] >= thresholds) & prefix.frames["scene_change_prev"]
+            started = np.concatenate((np.zeros((1, starts.shape[1]), dtype=np.int64), starts.cumsum(axis=0)))
+            pending = (
+                started[events["end"] + self.merge_gap + 1, events["location"]]
+                - started[events["end"] + 1, events["location"]]
+            )
+            events = events[pending == 0]
+
+        new_events = [
+            (int(start), int(end), int(region))
+            for start, end, region in events
+            if (int(start), int(end), int(region)) not in emitted
+        ]
+        emitted.update(new_events)
+
+        names = [region.name for region in self.active_regions]
+        scene_changes = [(start, end, names[region]) for start, end, region in new_events]
+        for image in self._export_events(scene_changes, writers, signal.fps_num, signal.fps_den):
+            images.put(image)
+
+    def _get_props_coarse(self, masks: Dict[str, vs.VideoNode], step: int) -> DetectionSignal:
+        """Build the same signal as `_get_props` while only rendering frames near mask changes.
+
+        Every `step`-th frame is compared with the previous sample first. Only intervals whose masks differ by more
+        than the scene threshold of their region are bisected down to the adjacent frame pair where the change
+        happens, so a subtitle shorter than `step` frames that appears and disappears between two samples is missed.
+        """
+        names = list(masks)
+        thresholds = {region.name: region.scene_threshold for region in self.active_regions}
+        averaged = {name: mask.vszip.PlaneAverage([0]) for name, mask in masks.items()}
+        first = averaged[names[0]]
+        num_frames = first.num_frames
+        signal = DetectionSignal.empty(num_frames, names, first.fps_num, first.fps_den)
+        # Mask differences are only measured inside bisected intervals.
+        signal.frames["scene_diff_prev"] = np.nan
+        signal.frames["scene_diff_next"] = np.nan
+        if num_frames < 2:
+            return signal
+
+        samples = np.arange(0, num_frames, step)
+        if samples[-1] != num_frames - 1:
+            samples = np.append(samples, num_frames - 1)
+
+        # PlaneStatsDiff of each sample against the next one; SCDetect uses the same metric on adjacent frames.
+        pairs: Dict[str, vs.VideoNode] = {}
+        for name, clip in averaged.items():
+            coarse = clip[::step] if (num_frames - 1) % step == 0 else clip[::step] + clip[-1]
+            pairs[name] = core.std.PlaneStats(coarse[:-1], coarse[1:])
+        blank = core.std.BlankClip(first, length=len(samples) - 1, keep=True)
+        coarse_props = self._merge_props(blank, pairs, ("psmAvg", "PlaneStatsDiff"))
+
+        psm = np.full((num_frames, len(names)), np.nan, dtype=np.float32)
+        changed = np.zeros((len(samples) - 1, len(names)), dtype=np.bool_)
+
+        def _record(n: int, f: vs.VideoFrame) -> None:
+            props = f.props
+            for i, name in enumerate(names):
+                psm[samples[n], i] = props.get(f"{name}psmAvg", 0)
+                changed[n, i] = props.get(f"{name}PlaneStatsDiff", 0) > thresholds[name]
+
+        clip_async_render(coarse_props, None, f"Detecting subtitles (every {step} frames)...", _record)
+
+        intervals = [(int(sample), int(region)) for sample, region in zip(*np.nonzero(changed))]
+        with ThreadPoolExecutor(max_workers=core.num_threads, thread_name_prefix="bisect") as executor:
+            futures = [
+                executor.submit(
+                    self._bisect, averaged[names[i]], int(samples[n]), int(samples[n + 1]), thresholds[names[i]]
+                )
+                for n, i in intervals
+            ]
+            for (_, i), future in zip(intervals, futures):
+                frame_psm, changes = future.result()
+                for frame, value in frame_psm.items():
+                    psm[frame, i] = value
+                change_frames = np.asarray(changes, dtype=np.int64)
+                signal.frames["scene_change_next"][change_frames, i] = True
+                signal.frames["scene_change_prev"][change_frames + 1, i] = True
+        print(f"Rendered {len(samples)} samples and bisected {len(intervals)} intervals of {num_frames} frames")
+
+        # Frames between evaluated ones keep the last known value; only frames with a scene change are read anyway.
+        known = np.where(np.isnan(psm), 0, np.arange(num_frames)[:, None])
+        np.maximum.accumulate(known, axis=0, out=known)
+        signal.frames["psmAvg"] = np.take_along_axis(psm, known, axis=0)
+        return signal
+
+    def _bisect(
+        self, clip: vs.VideoNode, start: int, end: int, threshold: float
+    ) -> Tuple[Dict[int, float], List[int]]:
+        """Find every frame n in [start, end) whose mask differs from frame n + 1, skipping unchanged halves."""
+        peak = (1 << clip.format.bits_per_sample) - 1
+        frame_psm: Dict[int, float] = {}
+        planes: Dict[int, np.ndarray] = {}
+
+        def _fetch(n: int) -> np.ndarray:
+            if n not in planes:
+                frame = clip.get_frame(n)
+                frame_psm[n] = frame.props.get("psmAvg", 0)
+                planes[n] = np.asarray(frame[0]).astype(np.int32)
+            return planes[n]
+
+        def _differs(a: int, b: int) -> bool:
+            return np.abs(_fetch(a) - _fetch(b)).mean() / peak > threshold
+
+        changes: List[int] = []
+        stack = [(start, end)]
+        while stack:
+            a, b = stack.pop()
+            if b - a == 1:
+                if _differs(a, b):
+                    changes.append(a)
+                continue
+            middle = (a + b) // 2
+            # Both halves can hold a change, e.g. a subtitle replaced by another one inside the interval.
+            stack.extend((lo, hi) for lo, hi in ((middle, b), (a, middle)) if _differs(lo, hi))
+        return (frame_psm, sorted(changes))
+
+    def _load_signal(self, clip: vs.VideoNode) -> DetectionSignal | None:
+        if not self.reuse_signal or not self.signal_path.exists():
+            return None
+        try:
+            signal = DetectionSignal.load(self.signal_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cannot read detection signal {self.signal_path}, rendering again: {e}")
+            return None
+        names = [region.name for region in self.active_regions]
+        if not signal.matches(clip.num_frames, names, clip.fps_num, clip.fps_den):
+            print(f"Detection signal {self.signal_path} does not match the sources, rendering again.")
+            return None
+        print(f"Reusing detection signal from {self.signal_path}")
+        return signal
+
+    def _calibrate(self, signal: DetectionSignal) -> Tuple[DetectionSignal, List[float]]:
+        """Derive the psmAvg and scene change thresholds of every region from this signal.
+
+        Returns the signal with its scene changes cut at the new thresholds and the per-region psmAvg thresholds.
+        The configured regions are left alone, so the next episode starts from them again.
+        """
+        if np.isnan(signal.frames["scene_diff_prev"]).any():
+            print(
+                "The signal has no scene differences (rendered with --coarse-step or without --auto-threshold), "
+                + "so only psmAvg thresholds can be calibrated."
+            )
+        psm_thresholds, scene_thresholds = calibrate_thresholds(
+            signal, self._psm_thresholds(), [region.scene_threshold for region in self.active_regions]
         )
+        for region, psm_threshold, scene_threshold in zip(self.active_regions, psm_thresholds, scene_thresholds):
+            print(
+                f"{region.name} region: psmAvg threshold {psm_threshold:.3f}, "
+                + f"scene change threshold {scene_threshold:.4f}"
+            )
+        return (signal.with_scene_thresholds(scene_thresholds), psm_thresholds)
 
     def _get_scene_changes(
-        self, rendered_props: List[Dict[str, int | float]], bot_clip: vs.VideoNode, top_clip: vs.VideoNode
-    ) -> List[Tuple[int, int, Location]]:
-        scene_changes: List[Tuple[int, int, Location]] = []
-        current_start = {Location.TOP: None, Location.BOT: None}
-        
+        self, signal: DetectionSignal, psm_thresholds: List[float] | None = None
+    ) -> List[Tuple[int, int, str]]:
+        names = [region.name for region in self.active_regions]
+        if psm_thresholds is None:
+            psm_thresholds = self._psm_thresholds()
+        events = segment_events(signal, psm_thresholds, self.min_duration, self.merge_gap)
+        return [(int(start), int(end), names[region]) for start, end, region in events]
+
+    def _export_events(
+        self, scene_changes: List[Tuple[int, int, str]], writers: Dict[str, vs.VideoNode], fpsnum: int, fpsden: int
+    ) -> List[OCRImage]:
         with ThreadPoolExecutor(max_workers=4, thread_name_prefix="image_writer") as executor:
-            futures = []
-            
-            for n, props in enumerate(rendered_props):
-                for location in Location:
-                    location_str = location.value
-                    if props[f"{location_str}psmAvg"] < 0.9:
-                        continue
-                    elif props[f"{location_str}_SceneChangePrev"] == 1:
-                        current_start[location] = n
-                    elif props[f"{location_str}_SceneChangeNext"] == 1 and current_start[location] is not None:
-                        source_clip = bot_clip if location == Location.BOT else top_clip
-
-                        
-                        scene_changes.append((current_start[location], n, location))
-                        
-                        future = executor.submit(
-                            self._write_image, 
-                            source_clip, 
-                            current_start[location], 
-                            location
-                        )
-                        futures.append(future)
-                        
-                        current_start[location] = None
-            
-            for future in futures:
-                future.result()
-        
-        return scene_changes
+            futures = [
+                executor.submit(self._export_event, writers[name], start, end, name, fpsnum, fpsden)
+                for start, end, name in scene_changes
+            ]
+            exported = [future.result() for future in futures]
+        self.exported.extend(
+            (start, end, name, image) for (start, end, name), image in zip(scene_changes, exported) if image is not None
+        )
+        return [image for image in exported if image is not None]
 
-    def _write_image(self, source_clip: vs.VideoNode, frame_number: int, location: Location) -> None:
+    def _export_event(
+        self, writer: vs.VideoNode, start: int, end: int, name: str, fpsnum: int, fpsden: int
+    ) -> OCRImage | None:
+        """Render the first frame of an event and return it under its final `{name}_{timecode}.jpg` name."""
         try:
-            crop_value = int(source_clip.width / 3)
-            crop_value = crop_value if crop_value % 2 == 0 else crop_value - 1
-
-            if source_clip.format.color_family != vs.YUV:
-                source_clip = Bilinear().resample(source_clip, format=vs.YUV420P8)
-            crop = source_clip.acrop.AutoCrop(top=0, bottom=0, left=crop_value, right=crop_value)
-            crop = Bilinear().resample(crop, format=vs.RGB24, matrix_in_s="709")
-            images = crop.imwri.Write(
-                imgformat="JPEG", 
-                filename=f"{self.images_dir}/{location.value}_%d.jpg", 
-                quality=90
-            )
-            images.get_frame(frame_number)            
+            frame = writer.get_frame(start)
         except Exception as e:
-            print(f"Error writing image {location.value}_{frame_number}.jpg: {e}")
+            print(f"Error rendering image {name}_{start}: {e}")
+            return None
+
+        array = self._frame_to_array(frame)
+        if self.trim:
+            array = trim_image(array, self.trim_pad, self.grayscale)
+        elif self.grayscale:
+            array = to_gray(array)
+
+        image_name = self._image_name(start, end, name, fpsnum, fpsden)
+        if self.save_images:
+            Image.fromarray(array).save(self.images_dir / image_name, quality=90)
+        if self.in_memory:
+            return OCRImage(image_name, array)
+        return OCRImage(image_name, self.images_dir / image_name)
 
-    def _rename_images(self, scene_changes: List[Tuple[int, int, Location]], fpsnum: int, fpsden: int):
-        for scene_change in scene_changes:
-            # Concat location (top, bot) to filename
-            loc = scene_change[2].value
-            frame_start = scene_change[0]
-            frame_end = scene_change[1]
+    def _frame_to_array(self, frame: vs.VideoFrame) -> np.ndarray:
+        """Copy the planes of an RGB frame once into the H x W x 3 layout the OCR engines read."""
+        array = np.empty((frame.height, frame.width, 3), dtype=np.uint8)
+        for plane in range(3):
+            array[:, :, plane] = np.asarray(frame[plane])
+        return array
 
-            filename = f"{loc}_{self._format_frame_time(frame_start, frame_end, fpsnum, fpsden)}"
-            dst_path = Path(f"{self.images_dir}/{filename}.jpg")
+    def _psm_thresholds(self) -> List[float]:
+        return [
+            self.psm_threshold if region.psm_threshold is None else region.psm_threshold
+            for region in self.active_regions
+        ]
+
+    def _build_writer(self, source_clip: vs.VideoNode, name: str) -> vs.VideoNode:
+        """Build the RGB export chain once per region. The subtitles are merged onto a blank clip, so the text
+        bounding box is found on the rendered frame by `trim_image`."""
+        if source_clip.format.color_family != vs.YUV:
+            source_clip = Bilinear().resample(source_clip, format=vs.YUV420P8)
+        return Bilinear().resample(source_clip, format=vs.RGB24, matrix_in_s="709")
+
+    def _image_name(self, frame_start: int, frame_end: int, loc: str, fpsnum: int, fpsden: int) -> str:
+        # Concat region name (bot, top, ...) to filename
+        filename = f"{loc}_{self._format_frame_time(frame_start, frame_end, fpsnum, fpsden)}"
+        with _name_lock:
+            image_name = f"{filename}.jpg"
             i = 1
-            while dst_path.exists():
-                dst_path = Path(f"{self.images_dir}/{filename}_{i}.jpg")
+            while image_name in self.image_names or (self.images_dir / image_name).exists():
+                image_name = f"{filename}_{i}.jpg"
                 i += 1
-            if Path(f"{self.images_dir}/{loc}_{frame_start}.jpg").exists():
-                rename(f"{self.images_dir}/{loc}_{frame_start}.jpg", dst_path)
-            else:
-                print(f"Image {loc}_{frame_start}.jpg not found")
+            self.image_names.add(image_name)
+        return image_name
 
     def _format_frame_time(self, start_frame: int, end_frame: int, fpsnum: int, fpsden: int) -> str:
         def frame_to_time_ms(frame: int) -> int:
@@ -209,6 +1048,169 @@ class Filter:
         return (f"{hours}", f"{minutes:02d}", f"{seconds:02d}", f"{centiseconds:02d}")
 
 
+
+class HardsubFilter(Filter):
+    """Detect subtitles from the hardsub alone, for episodes without a clean source.
+
+    Subtitle text is a dense cluster of strong edges that stays in place while the picture under it moves. The mask
+    keeps strong edges that are also found, over unchanged luma, in the previous or next frame, and only where such
+    edges are dense. A static background with sharp detail is taken for text as well, so this suits simple sources;
+    regions, streaming, workers and the signal work as with two sources.
+    """
+
+    EDGE_THRESHOLD: int = 96
+    MOTION_THRESHOLD: int = 6
+    DENSITY_THRESHOLD: int = 32
+
+    def __init__(self, hardsub_path: str | Path, sub_offset: int, images_dir: Path, **kwargs):
+        # There is no second source to sync against.
+        kwargs["sync_search"] = 0
+        super().__init__(hardsub_path, sub_offset, hardsub_path, sub_offset, images_dir, **kwargs)
+
+    def _load_sources(self) -> Tuple[vs.VideoNode, vs.VideoNode]:
+        """Return the hardsub twice, so the graph decodes it once."""
+        hardsub = source(self.hardsub_path)[self.sub_offset :]
+        if hardsub.height > 720:
+            hardsub = Bilinear().scale(hardsub, width=get_w(720, hardsub), height=720)
+        hardsub = depth(hardsub, 8)
+        return (hardsub, hardsub)
+
+    def _discovery_mask(self, detect_clean_y: vs.VideoNode, detect_hardsub_y: vs.VideoNode) -> vs.VideoNode:
+        # Sampled frames are far apart, so only edge density is available for discovery.
+        return self._dense(self._edges(detect_hardsub_y), 2)
+
+    def _get_mask(self, detect_clean_y: vs.VideoNode, detect_hardsub_y: vs.VideoNode, radius: int) -> vs.VideoNode:
+        y = detect_hardsub_y
+        edges = self._edges(y)
+        prev_y, next_y = y[0] + y[:-1], y[1:] + y[-1]
+        prev_edges, next_edges = edges[0] + edges[:-1], edges[1:] + edges[-1]
+        # An edge pixel is stable when it is an edge with the same luma in a neighbouring frame; either neighbour
+        # is enough, so the first and last frame of a subtitle keep their mask.
+        stable = core.akarin.Expr(
+            [edges, prev_edges, next_edges, y, prev_y, next_y],
+            f"x y min a b - abs {self.MOTION_THRESHOLD} < and x z min a c - abs {self.MOTION_THRESHOLD} < and or "
+            + "255 0 ?",
+        )
+        return self._dilate(self._dense(stable, radius), radius)
+
+    def _subtitle_pixels(self, clean: vs.VideoNode, hardsub: vs.VideoNode) -> vs.VideoNode:
+        return hardsub
+
+    def _edges(self, y: vs.VideoNode) -> vs.VideoNode:
+        return y.std.Sobel().std.Binarize(self.EDGE_THRESHOLD)
+
+    def _dense(self, edges: vs.VideoNode, radius: int) -> vs.VideoNode:
+        """Keep the parts of a binary edge mask where edges cover a text-like share of the neighbourhood."""
+        return box_blur(edges, radius).std.Binarize(self.DENSITY_THRESHOLD)
+
+
+
+class MultiFilter:
+    """Detect subtitles in several hardsub releases of one clean source in a single render.
+
+    Every hardsub keeps its own Filter (images folder, signal and cache), but they share the clean-side clips, from
+    decoding to the blurred detection crops, and their props are merged into one clip. Each clean frame is then
+    decoded and prepared once for all hardsubs.
+    """
+
+    def __init__(
+        self, clean_path: str | Path, clean_offset: int, hardsubs: List[Tuple[str | Path, int, Path]], **kwargs
+    ):
+        clean_clips: Dict[str, vs.VideoNode] = {}
+        self.filters: List[Filter] = []
+        for hardsub_path, sub_offset, images_dir in hardsubs:
+            filter = Filter(clean_path, clean_offset, hardsub_path, sub_offset, images_dir, **kwargs)
+            filter.clean_clips = clean_clips
+            self.filters.append(filter)
+
+    def filter_videos(self) -> List[List[OCRImage]]:
+        """Detect and export the subtitle images of every hardsub, in the order the hardsubs were given."""
+        exported: List[List[OCRImage]] = [[] for _ in self.filters]
+        if is_preview():
+            print("Several hardsubs cannot be previewed together; preview a single hardsub instead.")
+            return exported
+        if any(filter.incremental for filter in self.filters):
+            print("Several hardsubs are rendered in one pass; --incremental is not used.")
+        pending: Dict[int, str | None] = {}
+        for i, filter in enumerate(self.filters):
+            filter.image_names = set()
+            filter.exported = []
+            cache_key = filter._cache_key() if filter.cache else None
+            cached = filter._load_cache(cache_key) if cache_key is not None else None
+            if cached is None:
+                pending[i] = cache_key
+            else:
+                exported[i] = cached
+        if any(self.filters[i].coarse_step > 1 or self.filters[i].workers > 1 for i in pending):
+            print("Several hardsubs are rendered in one pass; --coarse-step and --workers are not used.")
+
+        graphs = {i: self.filters[i]._build_graph() for i in pending}
+        signals = {i: self.filters[i]._load_signal(graphs[i][3]) for i in pending}
+        render = [i for i, signal in signals.items() if signal is None]
+        if render:
+            signals.update(self._render({i: graphs[i][3] for i in render}))
+
+        for i, cache_key in pending.items():
+            filter = self.filters[i]
+            writers = {name: filter._build_writer(clip, name) for name, clip in graphs[i][2].items()}
+            exported[i] = filter._export_signal(signals[i], writers, cache_key)
+        return exported
+
+    def _render(self, merge_props: Dict[int, vs.VideoNode]) -> Dict[int, DetectionSignal]:
+        """Render the props clips of several hardsubs as one clip and save the signal of each.
+
+        The band thumbnails of all hardsubs are stacked into one frame, and every signal records its own rows.
+        """
+        length = max(clip.num_frames for clip in merge_props.values())
+        # A shorter release repeats its last frame up to the common length; those frames are not recorded.
+        padded = {
+            i: clip + clip[-1] * (length - clip.num_frames) if clip.num_frames < length else clip
+            for i, clip in merge_props.items()
+        }
+        combined = core.std.StackVertical(list(padded.values()))
+        recorders: Dict[int, Tuple[DetectionSignal, Callable[[int, vs.FrameProps, np.ndarray | None], None]]] = {}
+        rows: Dict[int, Tuple[int, int]] = {}
+        top = 0
+        for i, clip in merge_props.items():
+            filter = self.filters[i]
+            prefix = f"hardsub{i}"
+            props = tuple(
+                f"{region.name}{prop}" for region in filter.active_regions for prop in filter._subtitle_props()
+            )
+            combined = filter._merge_props(combined, {prefix: padded[i]}, props)
+            recorders[i] = filter._props_recorder(clip, prefix)
+            rows[i] = (top, top + clip.height)
+            top += clip.height
+
+        def _record(n: int, f: vs.VideoFrame) -> None:
+            props = f.props
+            bands = np.asarray(f[0])
+            for i, (signal, record) in recorders.items():
+                if n < signal.num_frames:
+                    record(n, props, bands[rows[i][0] : rows[i][1]])
+
+        clip_async_render(combined, None, f"Detecting subtitles in {len(merge_props)} hardsubs...", _record)
+        for i, (signal, _) in recorders.items():
+            signal.save(self.filters[i].signal_path)
+        return {i: signal for i, (signal, _) in recorders.items()}
+
+
+_segment_filter: Filter | None = None
+_segment_props: vs.VideoNode | None = None
+
+
+def _init_segment_worker(filter: Filter, threads: int) -> None:
+    global _segment_filter, _segment_props
+    core.num_threads = threads
+    _, _, _, _segment_props, _ = filter._build_graph()
+    _segment_filter = filter
+
+
+def _render_segment(start: int, end: int) -> np.ndarray:
+    assert _segment_filter is not None and _segment_props is not None
+    return _segment_filter._get_props(_segment_props[start:end], None).frames
+
+
 if is_preview():
     filter = Filter(r"[SubsPlease] Dandadan - 21 (720p) [FAF7CD93].mkv", 0, r"DAN DA DAN S2 - Tập 21 [Việt sub] [NUCEFo1g2LI].mp4", 0, images_dir=Path("images"))
     filter.filter_videos()
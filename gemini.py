@@ -4,17 +4,17 @@ import os
 import random
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from warnings import warn
 
 from openai import OpenAI
 from rich.console import Console
 from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
 
-from engine import OCREngine
+from engine import OCREngine, OCRImage, OCRResult
 from progress import BatchSpeedColumn
-from utils import collect_images, timecode_key
+from utils import get_image_encoded_bytes
 
 
 class Gemini(OCREngine):
@@ -76,6 +76,9 @@ For each image, provide the extracted subtitle text. If an image contains no sub
             self.max_retries = max_retries
             self.retry_delay = retry_delay
 
+            self.batch_lock = Lock()
+            self.batch_counter = 0
+
         except ImportError:
             raise ImportError("google-genai package is required for GeminiOCREngine"
                               "Try pip install google-genai")
@@ -83,16 +86,27 @@ For each image, provide the extracted subtitle text. If an image contains no sub
     @property
     def engine_name(self) -> str:
         return f"Gemini Batch ({self.model_name}, batch_size={self.batch_size})"
+
+    @property
+    def supports_batches(self) -> bool:
+        return True
+
+    @property
+    def concurrency(self) -> int:
+        return self.max_workers
+
+    @property
+    def chunk_size(self) -> int:
+        return self.batch_size
+
+    def process_batch(self, images: List[OCRImage]) -> Dict[str, str]:
+        with self.batch_lock:
+            self.batch_counter += 1
+            batch_num = self.batch_counter
+        return self._process_batch(images, batch_num)
     
-    def __call__(self, images_dir: Path) -> Dict[str, str]:
-        images = collect_images(images_dir)
-        
-        if not images:
-            warn(f"No images found in {images_dir}")
-            return {}
-        
-        results = {}
-        
+    def stream_images(self, images: Iterable[OCRImage]) -> Iterator[OCRResult]:
+        images = list(images)
         batches = [images[i:i + self.batch_size] for i in range(0, len(images), self.batch_size)]
         
         with Progress(
@@ -117,37 +131,41 @@ For each image, provide the extracted subtitle text. If an image contains no sub
                     
                     try:
                         batch_results = future.result()
-                        
-                        results.update(batch_results)
-                            
+                        batch_error = None
                     except Exception as e:
                         self.console.print(f"[red]Batch {batch_idx + 1} failed: {e}[/red]")
-                        for img_path in batch:
-                            results[img_path.name] = ""
+                        batch_results = {}
+                        batch_error = e
 
                     progress.update(task, advance=1)
-        
-        return dict(sorted(results.items(), key=timecode_key))
+
+                    for image in batch:
+                        if image.name in batch_results:
+                            yield OCRResult(image.name, batch_results[image.name])
+                        else:
+                            yield OCRResult(
+                                image.name, "", batch_error or ValueError("Model returned no result for image")
+                            )
     
-    def _encode_image(self, image_path: Path) -> Optional[str]:
+    def _encode_image(self, image: OCRImage) -> Optional[Tuple[str, str]]:
         try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+            image_bytes, image_format = get_image_encoded_bytes(image.data)
+            return (base64.b64encode(image_bytes).decode('utf-8'), image_format)
         except Exception as e:
-            self.console.print(f"[red]Failed to encode {image_path.name}: {e}[/red]")
+            self.console.print(f"[red]Failed to encode {image.name}: {e}[/red]")
             return None
         
-    def _encode_images(self, img_paths: List[Path]) -> List[Tuple[str, str]]:
+    def _encode_images(self, img_paths: List[OCRImage]) -> List[Tuple[str, str, str]]:
         encoded_images = []
         
-        for path in img_paths:
-            encoded = self._encode_image(path)
+        for image in img_paths:
+            encoded = self._encode_image(image)
             if encoded is not None:
-                encoded_images.append((encoded, path.name))
+                encoded_images.append((encoded[0], image.name, encoded[1]))
     
         return encoded_images
     
-    def _process_batch(self, img_paths: List[Path], batch_num: int) -> Dict[str, str]:
+    def _process_batch(self, img_paths: List[OCRImage], batch_num: int) -> Dict[str, str]:
         encoded_images = []
         for attempt in range(self.max_retries + 1):
             try:
@@ -159,7 +177,7 @@ For each image, provide the extracted subtitle text. If an image contains no sub
                     time.sleep(total_delay)
                 
                 if not encoded_images:
-                    encoded_images: Dict[str, str] = self._encode_images(img_paths)
+                    encoded_images = self._encode_images(img_paths)
                             
                 metadata = f"Number of input images: {len(encoded_images)}\n"
                 full_prompt = metadata + self.promt
@@ -172,16 +190,11 @@ For each image, provide the extracted subtitle text. If an image contains no sub
                 ]
 
                 image_names: List[str] = []
-                for n, (encoded_image, image_name) in enumerate(encoded_images, 1):
+                for n, (encoded_image, image_name, image_format) in enumerate(encoded_images, 1):
                     content.append({
                         "type": "text",
                         "text": f"Image {n}:"
                     })
-                    image_format = "jpeg"
-                    if image_name.lower().endswith(('.png',)):
-                        image_format = "png"
-                    elif image_name.lower().endswith(('.webp',)):
-                        image_format = "webp"
                     
                     image_names.append(image_name)
                     content.append({
@@ -237,7 +250,7 @@ For each image, provide the extracted subtitle text. If an image contains no sub
             except Exception as e:
                 if attempt == self.max_retries:
                     self.console.print(f"[red]Batch {batch_num} - Final attempt failed: {e}[/red]")
-                    return {path: "" for path in img_paths}
+                    raise
                 else:
                     self.console.print(f"[yellow]Batch {batch_num} - Attempt {attempt + 1} failed: {e}[/yellow]")
                     continue
@@ -1,18 +1,40 @@
 import concurrent.futures
 import random
-from pathlib import Path
-from threading import Lock
-from typing import Any, Dict
+import time
+from collections import deque
+from threading import Event, Lock, Semaphore
+from typing import Any, Deque, Dict, Iterable, Iterator, List
 
 from httpx import Client
 from rich.console import Console
 from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
 
-from engine import OCREngine
+from engine import OCREngine, OCRImage, OCRResult
 from lens import (AppliedFilter, LensOverlayFilterType, LensOverlayRoutingInfo, LensOverlayServerRequest,
                   LensOverlayServerResponse, Platform, Surface,)
 from progress import ImageSecondSpeedColumn
-from utils import collect_images, get_image_raw_bytes_and_dims, timecode_key
+from utils import get_image_raw_bytes_and_dims
+
+
+class LatencyTracker:
+    """Running quantile over the most recent request latencies."""
+
+    def __init__(self, quantile: float = 0.95, window: int = 200, min_samples: int = 20):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.lock = Lock()
+
+    def add(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def cutoff(self) -> float | None:
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.quantile))]
 
 
 class GoogleLens(OCREngine):
@@ -30,28 +52,48 @@ class GoogleLens(OCREngine):
         "Accept-Encoding": "gzip, deflate, br, zstd",
     }
 
-    def __init__(self, threads: int = 16):
+    REQUEST_TIMEOUT: float = 40
+
+    def __init__(self, threads: int = 16, hedge_rate: float = 0.05):
         self.client: Client = Client()
         self.threads = threads
-        self.scan_lock = Lock()
         self.console = Console()
 
+        # Hedging: a request slower than the running p95 gets a duplicate, limited to hedge_rate of all requests.
+        # Separately, a hedged pair holds one of `threads` slots until both of its requests are done, so losers still
+        # waiting for the server never outnumber the callers and always find a free worker in `hedge_executor`.
+        self.hedge_rate = hedge_rate
+        self.latency = LatencyTracker()
+        self.hedge_lock = Lock()
+        self.hedge_slots = Semaphore(threads)
+        self.requests_sent = 0
+        self.hedges_sent = 0
+        self.hedge_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads * 2, thread_name_prefix="lens_request"
+        )
+
     def __del__(self):
+        self.hedge_executor.shutdown(wait=False, cancel_futures=True)
         self.client.close()
     
     @property
     def engine_name(self) -> str:
         return "Google Lens"
 
-    def __call__(self, images_dir: Path) -> Dict[str, str]:
-        """Process all images in a directory with threading - batch functionality."""
-        images = collect_images(images_dir)
-        
-        if not images:
-            self.console.print(f"[yellow]No images found in {images_dir}[/yellow]")
-            return {}
-        
-        results: Dict[str, str] = {}
+    @property
+    def supports_batches(self) -> bool:
+        return True
+
+    @property
+    def concurrency(self) -> int:
+        return self.threads
+
+    def process_batch(self, images: List[OCRImage]) -> Dict[str, str]:
+        return {image.name: self.process_image(image) for image in images}
+
+    def stream_images(self, images: Iterable[OCRImage]) -> Iterator[OCRResult]:
+        """Process images with threading, yielding each result as it completes."""
+        images = list(images)
         
         with Progress(
             TextColumn(f"[progress.description]{{task.description}} ({self.engine_name})"),
@@ -65,27 +107,21 @@ class GoogleLens(OCREngine):
             task = progress.add_task("Processing images", total=len(images))
             
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
-                future_to_image = {
-                    executor.submit(self.process_image, str(img_path)): img_path.name
-                    for img_path in images
-                }
+                future_to_image = {executor.submit(self.process_image, image): image.name for image in images}
                 
                 for future in concurrent.futures.as_completed(future_to_image):
                     img_name = future_to_image[future]
                     try:
                         text = future.result()
-                        with self.scan_lock:
-                            results[img_name] = text if text is not None else ""
+                        result = OCRResult(img_name, text if text is not None else "")
                     except Exception as exc:
                         self.console.print(f"[red]{img_name} generated an exception: {exc}[/red]")
-                        with self.scan_lock:
-                            results[img_name] = ""
+                        result = OCRResult(img_name, "", exc)
                     
                     progress.update(task, advance=1)
-        
-        return dict(sorted(results.items(), key=timecode_key))
+                    yield result
 
-    def process_image(self, img_path: str) -> str:
+    def process_image(self, image: OCRImage) -> str:
 
         request = LensOverlayServerRequest()
 
@@ -108,7 +144,7 @@ class GoogleLens(OCREngine):
         filter.filter_type = LensOverlayFilterType.AUTO_FILTER
         request.objects_request.request_context.client_context.client_filters.filter.append(filter)
 
-        image_data = get_image_raw_bytes_and_dims(img_path)
+        image_data = get_image_raw_bytes_and_dims(image.data)
         if image_data is not None:
             raw_bytes, width, height = image_data
 
@@ -116,7 +152,7 @@ class GoogleLens(OCREngine):
             request.objects_request.image_data.image_metadata.width = width
             request.objects_request.image_data.image_metadata.height = height
         else:
-            print(f"Error: Could not process image file '{img_path}'. Cannot populate image data in request.")
+            print(f"Error: Could not process image '{image.name}'. Cannot populate image data in request.")
 
         payload = request.SerializeToString()
 
@@ -125,17 +161,8 @@ class GoogleLens(OCREngine):
         last_exception = None
         for attempt in range(max_retries):
             try:
-                res = self.client.post(
-                    self.LENS_ENDPOINT,
-                    content=payload,
-                    headers=self.HEADERS,
-                    timeout=40,
-                )
-
-                if res.status_code == 200:
-                    break
-
-                raise Exception(f"Request failed with status code: {res.status_code}")
+                res = self._send(payload)
+                break
 
             except Exception as e:
                 last_exception = e
@@ -147,7 +174,7 @@ class GoogleLens(OCREngine):
                 continue
 
         if res != None:
-            response_proto = LensOverlayServerResponse().FromString(res.content)
+            response_proto = LensOverlayServerResponse().FromString(res)
             response_dict: dict[str, Any] = response_proto.to_dict()
 
             result: str = ""
@@ -155,7 +182,7 @@ class GoogleLens(OCREngine):
                 response_dict.get("objectsResponse", {}).get("text", {}).get("textLayout", {}).get("paragraphs", [])
             )
             if not paragraphs:
-                print(f"Empty OCR please check subtitle {img_path}")
+                print(f"Empty OCR please check subtitle {image.name}")
             separator = "\\n "
             for index, paragraph in enumerate(paragraphs):
                 if index > 0:
@@ -167,4 +194,78 @@ class GoogleLens(OCREngine):
                         result += plain_text + separator_text
 
             return result
-        return ""
\ No newline at end of file
+        return ""
+
+    def _send(self, payload: bytes) -> bytes:
+        if self.hedge_rate <= 0:
+            return self._request(payload)
+
+        with self.hedge_lock:
+            self.requests_sent += 1
+
+        lost = Event()
+        primary = self.hedge_executor.submit(self._request, payload, lost)
+        cutoff = self.latency.cutoff()
+        if cutoff is None:
+            return primary.result()
+
+        done, _ = concurrent.futures.wait([primary], timeout=cutoff)
+        if done or not self._take_hedge():
+            return primary.result()
+
+        hedge = self.hedge_executor.submit(self._request, payload, lost)
+        running = [2]
+
+        def _release(_: concurrent.futures.Future) -> None:
+            with self.hedge_lock:
+                running[0] -= 1
+                if running[0] == 0:
+                    self.hedge_slots.release()
+
+        primary.add_done_callback(_release)
+        hedge.add_done_callback(_release)
+
+        done, pending = concurrent.futures.wait([primary, hedge], return_when=concurrent.futures.FIRST_COMPLETED)
+        # Both may finish in the same wait; a successful one wins over a failed one.
+        succeeded = [future for future in done if future.exception() is None]
+        if not succeeded and pending:
+            return pending.pop().result()
+        winner = succeeded[0] if succeeded else done.pop()
+
+        # The loser stops reading its response and closes the connection as soon as the body starts arriving.
+        lost.set()
+        return winner.result()
+
+    def _take_hedge(self) -> bool:
+        with self.hedge_lock:
+            if self.hedges_sent + 1 > self.requests_sent * self.hedge_rate:
+                return False
+            if not self.hedge_slots.acquire(blocking=False):
+                return False
+            self.hedges_sent += 1
+            return True
+
+    def _request(self, payload: bytes, lost: Event | None = None) -> bytes:
+        start = time.perf_counter()
+        request = self.client.build_request(
+            "POST",
+            self.LENS_ENDPOINT,
+            content=payload,
+            headers=self.HEADERS,
+            timeout=self.REQUEST_TIMEOUT,
+        )
+        res = self.client.send(request, stream=True)
+        try:
+            if res.status_code != 200:
+                raise Exception(f"Request failed with status code: {res.status_code}")
+
+            content = bytearray()
+            for chunk in res.iter_bytes():
+                if lost is not None and lost.is_set():
+                    raise Exception("Hedged request lost the race")
+                content += chunk
+        finally:
+            res.close()
+
+        self.latency.add(time.perf_counter() - start)
+        return bytes(content)
@@ -1,9 +1,13 @@
+import glob
+import json
+import re
 import warnings
 from pathlib import Path
+from typing import Dict, Iterable
 
 from ass import AssSubtitle
-from engine import OCREngine
-from utils import text_cleanup, timecode_key
+from engine import OCREngine, OCRImage
+from utils import split_image_name, text_cleanup, timecode_key
 
 
 class OCR_Subtitles:
@@ -23,22 +27,95 @@ class OCR_Subtitles:
         self.images_dir, self.output_file_path = self._process_file(
             output_subtitles_name, output_directory, images_dir_override
         )
+        self.output_subtitles_name: str = str(output_subtitles_name)
+        self.checkpoint_path: Path = self.output_file_path.with_suffix(".ocr.jsonl")
         self.completed_scans: int = 0
 
-    def __call__(self):
-        results = self.ocr_engine(self.images_dir)
-        
-        if not results:
+    def __call__(
+        self, images: Iterable[OCRImage] | None = None, live: bool = False, reuse: Dict[str, str] | None = None
+    ):
+        """OCR every image in `images_dir`, or the given images instead.
+
+        With `live`, OCR starts on the first images while `images` is still producing the rest. `reuse` maps image
+        names to texts from an earlier run that are written as they are, without OCR.
+        """
+        if images is None:
+            results = self.ocr_engine.stream(self.images_dir)
+        elif live:
+            results = self.ocr_engine.stream_live(images)
+        else:
+            results = self.ocr_engine.stream_images(images)
+
+        failed_scans = 0
+        # Raw OCR results are appended as they arrive, so an interrupted run still leaves everything scanned so far.
+        with self.checkpoint_path.open("w", encoding="utf-8") as checkpoint:
+            if reuse:
+                print(f"Reusing {len(reuse)} subtitles from the previous run")
+            for image_name, text in (reuse or {}).items():
+                self.completed_scans += 1
+                self._create_subtitle(image_name, text)
+                _ = checkpoint.write(
+                    json.dumps({"image": image_name, "text": text, "error": None}, ensure_ascii=False) + "\n"
+                )
+
+            for result in results:
+                self.completed_scans += 1
+                if result.error is not None:
+                    failed_scans += 1
+
+                self._create_subtitle(result.image_name, result.text)
+
+                _ = checkpoint.write(
+                    json.dumps(
+                        {
+                            "image": result.image_name,
+                            "text": result.text,
+                            "error": str(result.error) if result.error is not None else None,
+                        },
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+                checkpoint.flush()
+
+        if not self.completed_scans:
             warnings.warn("No images processed or no text extracted.")
             return
-                
-        for img_name, text in results.items():
-            self._create_subtitle(img_name, text)
-        
+
+        if failed_scans:
+            warnings.warn(f"{failed_scans}/{self.completed_scans} images failed to OCR.")
+
         self._write_ass()
         
         print(f"Saved subtitles to {self.output_file_path}")
 
+    def previous_results(self) -> Dict[str, str]:
+        """Return the texts of the images OCRed without error by the latest earlier run into this output folder.
+
+        Earlier runs wrote `{name}.ocr.jsonl` or, when that subtitle file existed, `{name}_<counter>.ocr.jsonl`.
+        """
+        # The name is matched literally: release names often hold brackets, and `ep1` must not pick up `ep10`.
+        own_run = re.compile(rf"{re.escape(self.output_subtitles_name)}(_\d+)?\.ocr\.jsonl")
+        checkpoints = [
+            path
+            for path in self.output_file_path.parent.glob(f"{glob.escape(self.output_subtitles_name)}*.ocr.jsonl")
+            if path != self.checkpoint_path and own_run.fullmatch(path.name)
+        ]
+        if not checkpoints:
+            return {}
+
+        latest = max(checkpoints, key=lambda path: path.stat().st_mtime)
+        texts: Dict[str, str] = {}
+        with latest.open("r", encoding="utf-8") as checkpoint:
+            for line in checkpoint:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("error") is None:
+                    texts[entry["image"]] = entry["text"]
+        return texts
+
     def _process_file(
         self,
         output_subtitles_name: str | Path,
@@ -73,22 +150,21 @@ class OCR_Subtitles:
         
         text = text_cleanup(text)
 
+        region, timecode = split_image_name(img_name)
         try:
             # Parse filename for timing information
-            if img_name.split("_")[0] == "top" or img_name.split("_")[0] == "bot":
-                is_top = img_name.split("_")[0] == "top"
-                start_hour = img_name.split("_")[1][:2]
-                start_min = img_name.split("_")[2][:2]
-                start_sec = img_name.split("_")[3][:2]
-                start_micro = img_name.split("_")[4][:2]
-
-                end_hour = img_name.split("__")[1].split("_")[0][:2]
-                end_min = img_name.split("__")[1].split("_")[1][:2]
-                end_sec = img_name.split("__")[1].split("_")[2][:2]
-                end_micro = img_name.split("__")[1].split("_")[3][:2]
+            if region is not None:
+                start_hour = timecode.split("_")[0][:2]
+                start_min = timecode.split("_")[1][:2]
+                start_sec = timecode.split("_")[2][:2]
+                start_micro = timecode.split("_")[3][:2]
+
+                end_hour = timecode.split("__")[1].split("_")[0][:2]
+                end_min = timecode.split("__")[1].split("_")[1][:2]
+                end_sec = timecode.split("__")[1].split("_")[2][:2]
+                end_micro = timecode.split("__")[1].split("_")[3][:2]
             else:
                 # Backward compatibility
-                is_top = False
                 start_hour = img_name.split("_")[0][:2]
                 start_min = img_name.split("_")[1][:2]
                 start_sec = img_name.split("_")[2][:2]
@@ -106,47 +182,38 @@ class OCR_Subtitles:
         start_time = f"{start_hour}:{start_min}:{start_sec},{start_micro}"
         end_time = f"{end_hour}:{end_min}:{end_sec},{end_micro}"
 
-        subtitle = AssSubtitle(start_time, end_time, text, is_top)
+        # Regions other than the default strips keep their name in the event's Name field.
+        subtitle = AssSubtitle(
+            start_time, end_time, text, region == "top", name=region if region not in (None, "bot", "top") else ""
+        )
         self.ass_dict[img_name] = subtitle
 
     def _write_ass(self):
-        cleaned_ass_bot = []
-        cleaned_ass_top = []
-        previous_subtitle_bot = None
-        previous_subtitle_top = None
+        # Events are merged per region, keyed by style and name; bottom events come first, top events last.
+        cleaned_ass: dict[tuple[str, str], list[AssSubtitle]] = {}
         for _, subtitle in sorted(self.ass_dict.items(), key=timecode_key):
-            previous_subtitle = previous_subtitle_top if subtitle.is_top else previous_subtitle_bot
-            cleaned_ass = cleaned_ass_top if subtitle.is_top else cleaned_ass_bot
+            region_ass = cleaned_ass.setdefault((subtitle.style_name, subtitle.name), [])
             if not subtitle.text_content or subtitle.text_content.isspace():
                 continue
-            if not previous_subtitle:
-                cleaned_ass.append(subtitle)
-                if subtitle.is_top:
-                    previous_subtitle_top = subtitle
-                else:
-                    previous_subtitle_bot = subtitle
-                continue
-            if previous_subtitle.text_content.lower() == subtitle.text_content.lower():
+            previous_subtitle = region_ass[-1] if region_ass else None
+            if previous_subtitle and previous_subtitle.text_content.lower() == subtitle.text_content.lower():
                 merged_subtitle = AssSubtitle(
                     start_time=previous_subtitle.start_time,
                     end_time=subtitle.end_time,
                     text_content=previous_subtitle.text_content,
                     is_top=subtitle.is_top,
+                    name=subtitle.name,
                 )
-                cleaned_ass.pop()
-                cleaned_ass.append(merged_subtitle)
-            else:
-                cleaned_ass.append(subtitle)
-
-            if subtitle.is_top:
-                previous_subtitle_top = cleaned_ass[-1]
+                region_ass.pop()
+                region_ass.append(merged_subtitle)
             else:
-                previous_subtitle_bot = cleaned_ass[-1]
+                region_ass.append(subtitle)
         try:
             with self.output_file_path.open("w", encoding="utf-8") as ass_file:
                 _ = ass_file.write(AssSubtitle.ASS_HEADER)
-                for subtitle in cleaned_ass_bot + cleaned_ass_top:
-                    _ = ass_file.write(str(subtitle))
+                for key in sorted(cleaned_ass):
+                    for subtitle in cleaned_ass[key]:
+                        _ = ass_file.write(str(subtitle))
         except IOError as e:
             print(f"Error writing to output file {self.output_file_path}: {e}")
             raise
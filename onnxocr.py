@@ -0,0 +1,213 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from rich.console import Console
+from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
+
+from engine import OCREngine, OCRImage, OCRResult
+from progress import ImageSecondSpeedColumn
+from utils import open_image
+
+
+class OnnxOCR(OCREngine):
+    """Offline text recognition with a CTC model (PaddleOCR PP-OCR rec layout) on ONNX Runtime.
+
+    Subtitle strips are split into text lines, every line of a batch of images is resized to the model height,
+    and the lines are recognised together in width-sorted batches.
+    """
+
+    DEFAULT_HEIGHT: int = 48
+    MAX_LINE_WIDTH: int = 2048
+    LINE_SEPARATOR: str = "\\n"
+
+    def __init__(
+        self,
+        model_path: str | Path,
+        dict_path: str | Path,
+        threads: int | None = None,
+        batch_size: int = 32,
+    ):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime package is required for OnnxOCR. Try pip install onnxruntime")
+
+        self.model_path = Path(model_path)
+        self.threads = threads or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.console = Console()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self.session = ort.InferenceSession(
+            str(self.model_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name: str = model_input.name
+        self.height: int = model_input.shape[2] if isinstance(model_input.shape[2], int) else self.DEFAULT_HEIGHT
+
+        with open(dict_path, "r", encoding="utf-8") as dict_file:
+            characters = [line.rstrip("\r\n") for line in dict_file]
+        # CTC blank first, PaddleOCR's use_space_char last.
+        self.characters: List[str] = ["", *characters, " "]
+
+    @property
+    def engine_name(self) -> str:
+        return f"ONNX Runtime ({self.model_path.name}, threads={self.threads})"
+
+    @property
+    def supports_batches(self) -> bool:
+        return True
+
+    @property
+    def chunk_size(self) -> int:
+        return self.batch_size
+
+    def stream_images(self, images: Iterable[OCRImage]) -> Iterator[OCRResult]:
+        images = list(images)
+        batches = [images[i : i + self.batch_size] for i in range(0, len(images), self.batch_size)]
+
+        with Progress(
+            TextColumn(f"[progress.description]{{task.description}} ({self.engine_name})"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TextColumn("{task.percentage:>3.0f}%"),
+            ImageSecondSpeedColumn(),
+            TimeRemainingColumn(),
+            console=self.console,
+        ) as progress:
+            task = progress.add_task("Processing images", total=len(images))
+
+            # Decoding and line splitting of the next batch overlaps with inference of the current one.
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="onnx_prepare") as executor:
+                pending = executor.submit(self._prepare_batch, batches[0]) if batches else None
+                for batch_idx in range(len(batches)):
+                    lines, errors = pending.result()
+                    if batch_idx + 1 < len(batches):
+                        pending = executor.submit(self._prepare_batch, batches[batch_idx + 1])
+
+                    try:
+                        texts = self._recognize_images(lines)
+                        batch_error = None
+                    except Exception as e:
+                        self.console.print(f"[red]Batch {batch_idx + 1} failed: {e}[/red]")
+                        texts = {}
+                        batch_error = e
+
+                    for image in batches[batch_idx]:
+                        progress.update(task, advance=1)
+                        if image.name in errors:
+                            yield OCRResult(image.name, "", errors[image.name])
+                        elif batch_error is not None:
+                            yield OCRResult(image.name, "", batch_error)
+                        else:
+                            yield OCRResult(image.name, texts.get(image.name, ""))
+
+    def process_batch(self, images: List[OCRImage]) -> Dict[str, str]:
+        """Images that cannot be read are left out of the result, so the scheduler hands them to other backends."""
+        lines, errors = self._prepare_batch(images)
+        if errors and not lines:
+            raise next(iter(errors.values()))
+        for name, error in errors.items():
+            self.console.print(f"[red]Cannot prepare {name}: {error}[/red]")
+        return self._recognize_images(lines)
+
+    def _prepare_batch(self, images: List[OCRImage]) -> Tuple[Dict[str, List[np.ndarray]], Dict[str, Exception]]:
+        lines: Dict[str, List[np.ndarray]] = {}
+        errors: Dict[str, Exception] = {}
+        for image in images:
+            try:
+                with open_image(image.data) as img:
+                    rgb = np.asarray(img.convert("RGB"))
+                lines[image.name] = [self._resize_line(line) for line in self._split_lines(rgb)]
+            except Exception as e:
+                errors[image.name] = e
+        return (lines, errors)
+
+    def _recognize_images(self, lines: Dict[str, List[np.ndarray]]) -> Dict[str, str]:
+        flat = [(name, index, line) for name, image_lines in lines.items() for index, line in enumerate(image_lines)]
+        # Sorting by width keeps padding small inside each inference batch.
+        flat.sort(key=lambda item: item[2].shape[1])
+
+        texts: Dict[str, Dict[int, str]] = {name: {} for name in lines}
+        for start in range(0, len(flat), self.batch_size):
+            batch = flat[start : start + self.batch_size]
+            decoded = self._recognize([line for _, _, line in batch])
+            for (name, index, _), text in zip(batch, decoded):
+                texts[name][index] = text
+
+        return {
+            name: self.LINE_SEPARATOR.join(
+                text for _, text in sorted(image_texts.items()) if text.strip()
+            )
+            for name, image_texts in texts.items()
+        }
+
+    def _recognize(self, lines: List[np.ndarray]) -> List[str]:
+        width = max(line.shape[1] for line in lines)
+        batch = np.zeros((len(lines), 3, self.height, width), dtype=np.float32)
+        for i, line in enumerate(lines):
+            batch[i, :, :, : line.shape[1]] = line.transpose(2, 0, 1)
+
+        preds = self.session.run(None, {self.input_name: batch})[0]
+        return self._ctc_decode(preds)
+
+    def _ctc_decode(self, preds: np.ndarray) -> List[str]:
+        indices = preds.argmax(axis=2)
+        keep = indices != 0
+        keep[:, 1:] &= indices[:, 1:] != indices[:, :-1]
+
+        texts: List[str] = []
+        for row, row_keep in zip(indices, keep):
+            texts.append("".join(self.characters[i] for i in row[row_keep] if i < len(self.characters)))
+        return texts
+
+    def _resize_line(self, line: np.ndarray) -> np.ndarray:
+        from PIL import Image
+
+        height, width = line.shape[:2]
+        target_width = min(self.MAX_LINE_WIDTH, max(self.height, math.ceil(self.height * width / height)))
+        resized = np.asarray(Image.fromarray(line).resize((target_width, self.height), Image.Resampling.BILINEAR))
+        # PP-OCR models are trained on BGR input normalised to [-1, 1].
+        return (resized[:, :, ::-1].astype(np.float32) / 127.5) - 1.0
+
+    def _split_lines(self, rgb: np.ndarray) -> List[np.ndarray]:
+        """Cut a subtitle strip into single text lines using the horizontal gradient energy per row."""
+        gray = rgb.mean(axis=2)
+        energy = np.abs(np.diff(gray, axis=1))
+        row_energy = energy.mean(axis=1)
+        if row_energy.max() <= 0:
+            return [rgb]
+
+        rows = row_energy > row_energy.max() * 0.2
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+        runs = [[start, end] for start, end in zip(edges[::2], edges[1::2])]
+
+        # Join runs split by thin gaps (diacritics, descenders) and drop specks.
+        merged: List[List[int]] = []
+        for run in runs:
+            if merged and run[0] - merged[-1][1] <= max(2, (merged[-1][1] - merged[-1][0]) // 4):
+                merged[-1][1] = run[1]
+            else:
+                merged.append(run)
+        tallest = max(end - start for start, end in merged)
+        merged = [run for run in merged if run[1] - run[0] >= max(6, tallest // 3)]
+        if not merged:
+            return [rgb]
+
+        lines: List[np.ndarray] = []
+        for start, end in merged:
+            pad = max(2, (end - start) // 5)
+            top, bottom = max(0, start - pad), min(rgb.shape[0], end + pad)
+            columns = np.flatnonzero(energy[top:bottom].mean(axis=0) > row_energy.max() * 0.2)
+            left, right = (columns[0], columns[-1] + 2) if columns.size else (0, rgb.shape[1])
+            left, right = max(0, left - 2 * pad), min(rgb.shape[1], right + 2 * pad)
+            lines.append(rgb[top:bottom, left:right])
+        return lines
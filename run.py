@@ -1,10 +1,13 @@
 import argparse
 import re
 from argparse import BooleanOptionalAction
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from queue import Queue
 from shutil import rmtree
+from typing import Any, Dict, List
 
-from engine import Engine
+from engine import Engine, OCRImage
 from ocr import OCR_Subtitles
 from utils import OCREngine, OCREngineType, create_ocr_engine, engine_type, float_range, ocr_engine_type
 from vsf import VideoSubFinder
@@ -45,6 +48,13 @@ def create_arg_parser() -> argparse.ArgumentParser:
         help=f"Select OCR engine. Choices: {[e.value for e in OCREngineType]}. Default: {OCREngineType.GGLENS.value}"
     )
     
+    _ = ocr_group.add_argument(
+        "--scheduler_backends",
+        type=str,
+        default="gglens,gemini",
+        help="Comma separated OCR engines sharing the image queue when --ocr_engine is scheduler. Default: gglens,gemini"
+    )
+
     # Google Lens settings
     _ = ocr_group.add_argument(
         "--gglens_thread",
@@ -52,6 +62,13 @@ def create_arg_parser() -> argparse.ArgumentParser:
         default=16,
         help="Google Lens OCR threads."
     )
+    _ = ocr_group.add_argument(
+        "--gglens_hedge_rate",
+        type=float_range(0, 1.0),
+        default=0.05,
+        help="Maximum fraction of Google Lens requests that may be duplicated once they run longer than the recent "
+        + "p95 latency. 0 disables hedging. Default: 0.05"
+    )
     
     # Gemini settings
     _ = ocr_group.add_argument(
@@ -91,6 +108,32 @@ def create_arg_parser() -> argparse.ArgumentParser:
         help="Maximum concurrent workers for Gemini batch processing. Default: 3"
     )
 
+    # ONNX Runtime settings
+    _ = ocr_group.add_argument(
+        "--onnx_model",
+        type=str,
+        default=None,
+        help="Path to a PaddleOCR-style text recognition model in ONNX format, used by the onnx OCR engine."
+    )
+    _ = ocr_group.add_argument(
+        "--onnx_dict",
+        type=str,
+        default=None,
+        help="Path to the character dictionary of the ONNX recognition model, one character per line."
+    )
+    _ = ocr_group.add_argument(
+        "--onnx_threads",
+        type=int,
+        default=None,
+        help="CPU threads used by ONNX Runtime. Default: all cores"
+    )
+    _ = ocr_group.add_argument(
+        "--onnx_batch_size",
+        type=int,
+        default=32,
+        help="Number of images recognised per ONNX inference batch. Default: 32"
+    )
+
     vpy_param_group = parser.add_argument_group(title="VapourSynth")
     _ = vpy_param_group.add_argument(
         "--output-name",
@@ -116,6 +159,16 @@ def create_arg_parser() -> argparse.ArgumentParser:
         + "In batch mode: regex pattern for matching hardsub files, with episode number as group 1.",
     )
 
+    _ = vpy_param_group.add_argument(
+        "--extra-hardsub",
+        action="append",
+        default=[],
+        dest="extra_hardsubs",
+        metavar="<hardsub>",
+        help="Another hardsub release of the same clean source; can be repeated. All hardsubs are detected in one "
+        + "render that prepares the clean source once, and each gets its own output folder named after it.",
+    )
+
     _ = vpy_param_group.add_argument(
         "--batch", action="store_true", help="Enable batch processing mode to handle multiple episodes"
     )
@@ -146,6 +199,193 @@ def create_arg_parser() -> argparse.ArgumentParser:
         help="Frame offset for hardsub video. Default: 0",
     )
 
+    _ = vpy_param_group.add_argument(
+        "--auto-offset",
+        default=0,
+        type=int,
+        dest="sync_search",
+        metavar="<frames>",
+        help="Search this many frames around --clean-offset/--hardsub-offset for the offset that lines the sources "
+        + "up, by correlating tiny luma thumbnails of a few windows, and report drift. Default: 0 (disabled)",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--reuse-signal",
+        action=BooleanOptionalAction,
+        default=False,
+        dest="reuse_signal",
+        help="Reuse the per-frame detection signal saved by a previous run (signal.npz in the output folder) "
+        + "instead of rendering the sources again. Default: False",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--auto-threshold",
+        action=BooleanOptionalAction,
+        default=False,
+        dest="auto_threshold",
+        help="Derive the psmAvg and scene change thresholds of every region from the histogram of the rendered "
+        + "signal instead of using the fixed values, and print them. Not used with --stream. Default: False",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--min-duration",
+        default=0,
+        type=int,
+        dest="min_duration",
+        metavar="<frames>",
+        help="Drop detected subtitles shorter than this many frames. Default: 0",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--merge-gap",
+        default=0,
+        type=int,
+        dest="merge_gap",
+        metavar="<frames>",
+        help="Merge detected subtitles at the same location separated by at most this many frames. Default: 0",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--dilation",
+        type=str,
+        default="separable",
+        choices=["iterate", "separable", "downscale"],
+        help="How the subtitle mask is dilated: iterate (ten std.Maximum passes), separable (same result in two "
+        + "passes) or downscale (approximate, at half resolution). Default: separable",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--detect-height",
+        default=360,
+        type=int,
+        dest="detect_height",
+        metavar="<pixels>",
+        help="Height of the luma pair used to detect subtitles. Images are still exported from the full "
+        + "resolution diff. Default: 360",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--coarse-step",
+        default=1,
+        type=int,
+        dest="coarse_step",
+        metavar="<frames>",
+        help="Render only every n-th frame first and bisect the intervals where the subtitle mask changes. "
+        + "Subtitles shorter than n frames can be missed. Default: 1 (render every frame)",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--roi-width",
+        default=0.8,
+        type=float_range(0.1, 1.0),
+        dest="roi_width",
+        metavar="<fraction>",
+        help="Width of the centered band searched for subtitles, as a fraction of the frame width. Default: 0.8",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--region",
+        action="append",
+        default=None,
+        dest="regions",
+        metavar="<name[:left,top,right,bottom[:threshold]]>",
+        help="Search this region for subtitles; repeat for more regions, all detected in one render. The rectangle "
+        + "is given in fractions of the frame and the optional threshold replaces 0.9 for the region. A bare "
+        + "bot or top selects the default strip. Default: bot and top inside --roi-width",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--discover-samples",
+        default=0,
+        type=int,
+        dest="discover_samples",
+        metavar="<frames>",
+        help="Mask this many frames spread over the episode before rendering, skip regions without subtitles and "
+        + "tighten the others to the rows where subtitles appear. Default: 0 (disabled)",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--in-memory",
+        action=BooleanOptionalAction,
+        default=False,
+        dest="in_memory",
+        help="Hand the RGB subtitle crops to OCR straight from VapourSynth frames instead of writing JPEG files "
+        + "and reading them back. Default: False",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--save-images",
+        action=BooleanOptionalAction,
+        default=False,
+        dest="save_images",
+        help="With --in-memory, still write the subtitle images to the images folder for debugging. Default: False",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--filter-cache",
+        action=BooleanOptionalAction,
+        default=True,
+        dest="cache",
+        help="Keep the exported subtitle images in filter_cache, keyed by fingerprints of both sources, the offsets "
+        + "and the detection settings, and skip detection when they match on a later run. Default: True",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--incremental",
+        action=BooleanOptionalAction,
+        default=False,
+        dest="incremental",
+        help="For a re-upload of an episode processed before into the same output folder: compare thumbnails of "
+        + "the subtitle bands with the previous signal, render and OCR only the changed parts and keep the earlier "
+        + "text for the rest. Default: False",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--stream",
+        action=BooleanOptionalAction,
+        default=False,
+        dest="stream",
+        help="Send every subtitle image to OCR as soon as its event is detected, so OCR runs while the rest of the "
+        + "episode is still rendering. --workers and --coarse-step are not used with it. Default: False",
+    )
+
+    _ = vpy_param_group.add_argument(
+        "--workers",
+        default=1,
+        type=int,
+        dest="workers",
+        metavar="<processes>",
+        help="Split the detection render into frame segments rendered by this many processes, each with its own "
+        + "VapourSynth core. Not used with --coarse-step. Default: 1",
+    )
+
+    image_param_group = parser.add_argument_group(title="Subtitle Images")
+    _ = image_param_group.add_argument(
+        "--trim",
+        action=BooleanOptionalAction,
+        default=True,
+        dest="trim",
+        help="Crop every subtitle image to the bounding box of its text before OCR, for both the VapourSynth and "
+        + "VideoSubFinder images. Default: True",
+    )
+
+    _ = image_param_group.add_argument(
+        "--trim-pad",
+        default=8,
+        type=int,
+        dest="trim_pad",
+        metavar="<pixels>",
+        help="Margin kept around the text when trimming. Default: 8",
+    )
+
+    _ = image_param_group.add_argument(
+        "--grayscale",
+        action=BooleanOptionalAction,
+        default=False,
+        dest="grayscale",
+        help="Send single-channel gray subtitle images to OCR. Default: False",
+    )
+
     vsf_param_group = parser.add_argument_group(title="VideoSubFinder")
     _ = vsf_param_group.add_argument(
         "-vsf",
@@ -309,7 +549,39 @@ def create_arg_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def process_vsf(video_list: list[Path], output_dir: str, vsf: VideoSubFinder, ocr_engine: OCREngine):
+def get_filter_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    return {
+        "reuse_signal": args.reuse_signal,
+        "min_duration": args.min_duration,
+        "merge_gap": args.merge_gap,
+        "dilation": args.dilation,
+        "detect_height": args.detect_height,
+        "coarse_step": args.coarse_step,
+        "roi_width": args.roi_width,
+        "discover_samples": args.discover_samples,
+        "regions": args.regions,
+        "workers": args.workers,
+        "in_memory": args.in_memory,
+        "save_images": args.save_images,
+        "trim": args.trim,
+        "trim_pad": args.trim_pad,
+        "grayscale": args.grayscale,
+        "sync_search": args.sync_search,
+        "auto_threshold": args.auto_threshold,
+        "cache": args.cache,
+        "incremental": args.incremental,
+    }
+
+
+def process_vsf(
+    video_list: list[Path],
+    output_dir: str,
+    vsf: VideoSubFinder,
+    ocr_engine: OCREngine,
+    trim: bool = True,
+    trim_pad: int = 8,
+    grayscale: bool = False,
+):
 
     print("Extracting subtitle images with VideoSubFinder (takes quite a long time) ...")
     video_num = len(video_list)
@@ -331,6 +603,10 @@ def process_vsf(video_list: list[Path], output_dir: str, vsf: VideoSubFinder, oc
         images_dir = Path(save_vsf_dir) / "RGBImages"
         if vsf.txtimage:
             images_dir = Path(save_vsf_dir) / "TXTImages"
+        if trim:
+            from trim import trim_images_dir
+
+            images_dir = trim_images_dir(images_dir, Path(save_vsf_dir) / "TrimmedImages", trim_pad, grayscale)
 
         ocr = OCR_Subtitles(output_subtitles_name=save_name, output_directory=save_dir, images_dir_override=images_dir, ocr_engine=ocr_engine)
         ocr()
@@ -338,6 +614,16 @@ def process_vsf(video_list: list[Path], output_dir: str, vsf: VideoSubFinder, oc
     return
 
 
+def clear_images_dir(images_dir: Path) -> None:
+    if images_dir.exists() and any(images_dir.iterdir()):
+        print(f"Removing existing images directory: {images_dir}")
+        try:
+            rmtree(images_dir)
+        except OSError as e:
+            print(f"Warning: Failed to remove directory {images_dir}. Error: {e}")
+    images_dir.mkdir(parents=True, exist_ok=True)
+
+
 def process_episode_vpy(
     output_subtitles_name: str,
     output_directory: str,
@@ -346,12 +632,14 @@ def process_episode_vpy(
     ocr_engine: OCREngine,
     clean_path: str | Path | None = None,
     sub_path: str | Path | None = None,
+    filter_kwargs: Dict[str, Any] | None = None,
+    stream: bool = False,
 ) -> None:
 
-    from filter import Filter
+    from filter import Filter, HardsubFilter
 
-    if not clean_path or not sub_path:
-        raise ValueError("clean_path and sub_path arguments are required when do_filter is True.")
+    if not sub_path:
+        raise ValueError("sub_path argument is required when do_filter is True.")
 
     save_name = Path(sub_path).stem
     if output_subtitles_name is not None:
@@ -361,21 +649,65 @@ def process_episode_vpy(
 
     engine = OCR_Subtitles(save_name, save_dir, save_img_dir, ocr_engine)
 
-    if engine.images_dir.exists() and any(engine.images_dir.iterdir()):
-        print(f"Removing existing images directory: {engine.images_dir}")
-        try:
-            rmtree(engine.images_dir)
-        except OSError as e:
-            print(f"Warning: Failed to remove directory {engine.images_dir}. Error: {e}")
-    engine.images_dir.mkdir(parents=True, exist_ok=True)
+    clear_images_dir(engine.images_dir)
+
+    if clean_path:
+        filter = Filter(clean_path, offset_clean, sub_path, offset_sub, engine.images_dir, **(filter_kwargs or {}))
+    else:
+        # Without a clean source, subtitles are detected from the hardsub alone.
+        filter = HardsubFilter(sub_path, offset_sub, engine.images_dir, **(filter_kwargs or {}))
+    if not stream:
+        if filter.incremental:
+            filter.previous_texts = engine.previous_results()
+        images = filter.filter_videos()
+        engine(images, reuse=filter.reused_texts)
+        return
+
+    # The filter runs in the background and hands over images as events are found; None ends the stream.
+    images: Queue[OCRImage | None] = Queue()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="filter") as executor:
+        filtering = executor.submit(filter.filter_videos, images)
+        engine(iter(images.get, None), live=True)
+        filtering.result()
 
-    filter = Filter(clean_path, offset_clean, sub_path, offset_sub, engine.images_dir)
-    filter.filter_videos()
 
-    engine()
+def process_hardsubs_vpy(
+    output_directory: str,
+    offset_clean: int,
+    offset_sub: int,
+    ocr_engine: OCREngine,
+    clean_path: str | Path,
+    sub_paths: List[str | Path],
+    filter_kwargs: Dict[str, Any] | None = None,
+) -> None:
+    """OCR several hardsub releases of one clean source, detecting the subtitles of all of them in one render."""
+    from filter import MultiFilter
 
+    engines: List[OCR_Subtitles] = []
+    for sub_path in sub_paths:
+        save_name = Path(sub_path).stem
+        save_dir = Path(output_directory) / save_name
+        engine = OCR_Subtitles(save_name, save_dir, save_dir / "images", ocr_engine)
+        clear_images_dir(engine.images_dir)
+        engines.append(engine)
 
-def batch_process_vpy(output_directory: str, clean_dir: str, sub_dir: str, offset_clean: int, offset_sub: int) -> None:
+    hardsubs = [(sub_path, offset_sub, engine.images_dir) for sub_path, engine in zip(sub_paths, engines)]
+    filter = MultiFilter(clean_path, offset_clean, hardsubs, **(filter_kwargs or {}))
+    for sub_path, engine, images in zip(sub_paths, engines, filter.filter_videos()):
+        print(f"Running OCR on {sub_path}")
+        engine(images)
+
+
+def batch_process_vpy(
+    output_directory: str,
+    clean_dir: str,
+    sub_dir: str,
+    offset_clean: int,
+    offset_sub: int,
+    ocr_engine: OCREngine,
+    filter_kwargs: Dict[str, Any] | None = None,
+    stream: bool = False,
+) -> None:
     print("Batch mode!")
     ep_regex = r"(.*?)(\d{2,3}).*"
     episodes: dict[str, dict[str, Path]] = {}
@@ -414,8 +746,11 @@ def batch_process_vpy(output_directory: str, clean_dir: str, sub_dir: str, offse
                 output_directory=output_directory,
                 offset_clean=offset_clean,
                 offset_sub=offset_sub,
+                ocr_engine=ocr_engine,
                 clean_path=files["clean"],
                 sub_path=files["hardsub"],
+                filter_kwargs=filter_kwargs,
+                stream=stream,
             )
         else:
             print(f"Skipping episode {episode} - missing clean or hardsub file")
@@ -453,10 +788,46 @@ def main():
         else:
             video_list = [Path(video_path)]
 
-        process_vsf(video_list, output_dir, vsf, ocr_engine=ocr_engine)
+        process_vsf(
+            video_list,
+            output_dir,
+            vsf,
+            ocr_engine=ocr_engine,
+            trim=args.trim,
+            trim_pad=args.trim_pad,
+            grayscale=args.grayscale,
+        )
+
+    elif engine == Engine.HARDSUB:
+        video_formats = [".mp4", ".avi", ".mov", ".mkv"]
+
+        video_path = args.video_dir
+        if video_path is None:
+            parser.error("--video-dir is required when using the hardsub engine")
+
+        if Path(video_path).is_dir():
+            video_list = Path(video_path).rglob("*.*")
+            video_list = sorted(v.absolute() for v in video_list if v.suffix.lower() in video_formats)
+        else:
+            video_list = [Path(video_path)]
+
+        filter_kwargs = get_filter_kwargs(args)
+        for i, one_video in enumerate(video_list):
+            print(f"[{i + 1}/{len(video_list)}] Detecting subtitles in {one_video}")
+            process_episode_vpy(
+                output_subtitles_name=args.output_subtitles if len(video_list) == 1 else None,
+                output_directory=output_dir,
+                offset_clean=0,
+                offset_sub=args.offset_sub,
+                sub_path=one_video,
+                ocr_engine=ocr_engine,
+                filter_kwargs=filter_kwargs,
+                stream=args.stream,
+            )
 
     elif engine == Engine.VAPOURSYNTH:
         video_formats = [".mp4", ".avi", ".mov", ".mkv"]
+        filter_kwargs = get_filter_kwargs(args)
         clean: str = args.clean
         sub: str = args.hardsub
         if not args.clean or not args.hardsub:
@@ -469,6 +840,21 @@ def main():
                 sub_dir=args.hardsub,
                 offset_clean=args.offset_clean,
                 offset_sub=args.offset_sub,
+                ocr_engine=ocr_engine,
+                filter_kwargs=filter_kwargs,
+                stream=args.stream,
+            )
+        elif args.extra_hardsubs:
+            if args.stream:
+                print("Several hardsubs are rendered together, --stream is not used.")
+            process_hardsubs_vpy(
+                output_directory=output_dir,
+                offset_clean=args.offset_clean,
+                offset_sub=args.offset_sub,
+                ocr_engine=ocr_engine,
+                clean_path=clean,
+                sub_paths=[sub, *args.extra_hardsubs],
+                filter_kwargs=filter_kwargs,
             )
         else:
             process_episode_vpy(
@@ -478,7 +864,9 @@ def main():
                 offset_sub=args.offset_sub,
                 sub_path=args.hardsub,
                 clean_path=args.clean,
-                ocr_engine=ocr_engine
+                ocr_engine=ocr_engine,
+                filter_kwargs=filter_kwargs,
+                stream=args.stream,
             )
 
     print("Done")
@@ -0,0 +1,194 @@
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from queue import Queue
+from threading import Condition
+from typing import Deque, FrozenSet, Iterable, Iterator, List, Tuple
+
+from rich.console import Console
+from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
+
+from engine import OCREngine, OCRImage, OCRResult
+from progress import ImageSecondSpeedColumn
+
+QueueItem = Tuple[OCRImage, FrozenSet[int]]
+
+
+class BackendStats:
+    def __init__(self):
+        self.images: int = 0
+        self.busy: float = 0.0
+
+    def throughput(self, concurrency: int) -> float | None:
+        """Images per second the backend delivers with all of its slots busy."""
+        if self.busy <= 0:
+            return None
+        return self.images / self.busy * concurrency
+
+
+class Scheduler(OCREngine):
+    """Share a single queue of images between several OCR engines.
+
+    Every backend gets one worker per `concurrency` slot. Idle workers pull the next chunk from the queue, so a
+    throttled backend simply takes less work while the others keep draining it. Images a backend fails on are put
+    back for the remaining backends.
+    """
+
+    def __init__(self, backends: List[OCREngine]):
+        if not backends:
+            raise ValueError("Scheduler needs at least one OCR backend.")
+        unsupported = [backend.engine_name for backend in backends if not backend.supports_batches]
+        if unsupported:
+            raise ValueError(f"Scheduler backends must support batches: {', '.join(unsupported)}")
+        self.backends = backends
+        self.console = Console()
+        self.condition = Condition()
+        self.in_flight = 0
+        self.feeding = False
+
+    @property
+    def engine_name(self) -> str:
+        return f"Scheduler ({', '.join(backend.engine_name for backend in self.backends)})"
+
+    @property
+    def concurrency(self) -> int:
+        return sum(backend.concurrency for backend in self.backends)
+
+    def stream_images(self, images: Iterable[OCRImage]) -> Iterator[OCRResult]:
+        return self._stream(deque((image, frozenset()) for image in images), None)
+
+    def stream_live(self, images: Iterable[OCRImage]) -> Iterator[OCRResult]:
+        return self._stream(deque(), images)
+
+    def _stream(self, queue: Deque[QueueItem], live: Iterable[OCRImage] | None) -> Iterator[OCRResult]:
+        """Drain `queue`, and with `live` also everything the iterable yields until it is exhausted."""
+        stats = [BackendStats() for _ in self.backends]
+        output: Queue[OCRResult | None] = Queue()
+        self.in_flight = 0
+        self.feeding = live is not None
+
+        with Progress(
+            TextColumn(f"[progress.description]{{task.description}} ({self.engine_name})"),
+            BarColumn(),
+            TextColumn("{task.completed}/{task.total}"),
+            TextColumn("{task.percentage:>3.0f}%"),
+            ImageSecondSpeedColumn(),
+            TimeRemainingColumn(),
+            console=self.console,
+        ) as progress:
+            task = progress.add_task("Processing images", total=len(queue) if live is None else None)
+
+            with ThreadPoolExecutor(max_workers=self.concurrency + 1, thread_name_prefix="ocr_scheduler") as executor:
+                feeder = executor.submit(self._feed, live, queue, progress, task) if live is not None else None
+                futures = [
+                    executor.submit(self._worker, index, queue, stats, output)
+                    for index, backend in enumerate(self.backends)
+                    for _ in range(backend.concurrency)
+                ]
+
+                # Every worker puts None on the output queue when it exits.
+                running = len(futures)
+                while running:
+                    result = output.get()
+                    if result is None:
+                        running -= 1
+                        continue
+                    progress.update(task, advance=1)
+                    yield result
+
+                for future in futures:
+                    future.result()
+                if feeder is not None:
+                    feeder.result()
+
+        for backend, backend_stats in zip(self.backends, stats):
+            rate = backend_stats.throughput(backend.concurrency) or 0
+            self.console.print(f"{backend.engine_name}: {backend_stats.images} images, {rate:.2f} images/s")
+
+    def _feed(self, images: Iterable[OCRImage], queue: Deque[QueueItem], progress: Progress, task: int) -> None:
+        """Move images into the shared queue while the caller is still producing them."""
+        total = 0
+        try:
+            for image in images:
+                total += 1
+                with self.condition:
+                    queue.append((image, frozenset()))
+                    self.condition.notify_all()
+                progress.update(task, total=total)
+        finally:
+            with self.condition:
+                self.feeding = False
+                self.condition.notify_all()
+
+    def _worker(
+        self,
+        index: int,
+        queue: Deque[QueueItem],
+        stats: List[BackendStats],
+        output: "Queue[OCRResult | None]",
+    ) -> None:
+        backend = self.backends[index]
+
+        try:
+            while True:
+                chunk = self._take(index, queue, stats)
+                if not chunk:
+                    return
+
+                start = time.perf_counter()
+                chunk_error = None
+                try:
+                    chunk_results = backend.process_batch([image for image, _ in chunk])
+                except Exception as exc:
+                    self.console.print(f"[red]{backend.engine_name} failed on {len(chunk)} images: {exc}[/red]")
+                    chunk_results = {}
+                    chunk_error = exc
+                elapsed = time.perf_counter() - start
+
+                with self.condition:
+                    self.in_flight -= 1
+                    stats[index].busy += elapsed
+                    for image, tried in reversed(chunk):
+                        tried = tried | {index}
+                        if image.name in chunk_results:
+                            output.put(OCRResult(image.name, chunk_results[image.name] or ""))
+                            stats[index].images += 1
+                        elif len(tried) < len(self.backends):
+                            queue.appendleft((image, tried))
+                        else:
+                            output.put(
+                                OCRResult(image.name, "", chunk_error or ValueError("No backend returned a result"))
+                            )
+                    self.condition.notify_all()
+        finally:
+            output.put(None)
+
+    def _take(self, index: int, queue: Deque[QueueItem], stats: List[BackendStats]) -> List[QueueItem]:
+        with self.condition:
+            while True:
+                size = self._chunk_size(index, len(queue), stats)
+                chunk = list(islice((item for item in queue if index not in item[1]), size))
+                if chunk:
+                    break
+                # Chunks in flight on other backends may still fail and come back for a retry here, and a live
+                # feed may still add images.
+                if self.in_flight == 0 and not self.feeding:
+                    return []
+                self.condition.wait()
+
+            for item in chunk:
+                queue.remove(item)
+            self.in_flight += 1
+            return chunk
+
+    def _chunk_size(self, index: int, remaining: int, stats: List[BackendStats]) -> int:
+        backend = self.backends[index]
+        rates = [backend_stats.throughput(b.concurrency) for backend_stats, b in zip(stats, self.backends)]
+        if any(rate is None for rate in rates) or sum(rates) <= 0:
+            return backend.chunk_size
+
+        # Claim no more than this backend's share of what is left, so a slow batch engine cannot sit on the tail.
+        share = rates[index] / sum(rates)
+        return max(1, min(backend.chunk_size, math.ceil(remaining * share / backend.concurrency)))
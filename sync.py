@@ -0,0 +1,65 @@
+from typing import List, NamedTuple
+
+import numpy as np
+
+
+class SyncEstimate(NamedTuple):
+    """Frame offset between two sources: clean frame `n + offset` shows the same picture as hardsub frame `n`.
+
+    `score` is the mean correlation at the offset, from -1 to 1, and `window_offsets` holds the best offset of every
+    sampled window on its own, in episode order.
+    """
+
+    offset: int
+    score: float
+    window_offsets: List[int]
+
+    @property
+    def drift(self) -> int:
+        """How far the per-window offsets spread; more than a frame means a single offset cannot sync the sources."""
+        return max(self.window_offsets) - min(self.window_offsets) if self.window_offsets else 0
+
+
+def motion_fingerprints(thumbnails: np.ndarray) -> np.ndarray:
+    """Turn (frames, pixels) luma thumbnails into per-frame motion vectors of unit length.
+
+    Frame-to-frame differences ignore the grading and brightness differences between two encodes and the static
+    parts of the picture, which correlate equally well at every offset. Frames without motion become zero vectors.
+    """
+    motion = np.diff(thumbnails.astype(np.float32), axis=0)
+    motion -= motion.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(motion, axis=1, keepdims=True)
+    return np.divide(motion, norms, out=np.zeros_like(motion), where=norms > 1e-3)
+
+
+def correlate_window(hardsub: np.ndarray, clean: np.ndarray) -> np.ndarray:
+    """Mean correlation of the `hardsub` fingerprints with `clean` at every lag, by FFT along the frame axis.
+
+    `clean` covers the hardsub window plus the search range on both sides, so the result has
+    `len(clean) - len(hardsub) + 1` entries and entry `lag` compares hardsub frame i with clean frame i + lag.
+    """
+    length = len(hardsub)
+    size = 1 << int(np.ceil(np.log2(len(clean) + length)))
+    spectrum = np.conj(np.fft.rfft(hardsub, n=size, axis=0)) * np.fft.rfft(clean, n=size, axis=0)
+    correlation = np.fft.irfft(spectrum.sum(axis=1), n=size)
+    return correlation[: len(clean) - length + 1] / length
+
+
+def estimate_offset(
+    hardsub_windows: List[np.ndarray], clean_windows: List[np.ndarray], base: int, search: int
+) -> SyncEstimate:
+    """Find the clean minus hardsub frame offset within `base - search` to `base + search`.
+
+    Every hardsub window holds the thumbnails of consecutive frames, and the clean window at the same index starts
+    `search` frames earlier and ends `search` frames later, both already shifted by `base`. The correlation curves of
+    all windows are summed for the episode offset, and every window's own peak is kept to report drift.
+    """
+    total = np.zeros(2 * search + 1, dtype=np.float64)
+    window_offsets: List[int] = []
+    for hardsub, clean in zip(hardsub_windows, clean_windows):
+        curve = correlate_window(motion_fingerprints(hardsub), motion_fingerprints(clean))
+        total += curve
+        window_offsets.append(int(np.argmax(curve)) - search + base)
+
+    best = int(np.argmax(total))
+    return SyncEstimate(best - search + base, float(total[best] / max(1, len(hardsub_windows))), window_offsets)
@@ -0,0 +1,83 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils import collect_images
+
+EDGE_THRESHOLD: float = 0.35
+MIN_EDGE: int = 24
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return image
+    # BT.601 luma in integer math, the same weights PIL uses for convert("L").
+    rgb = image[..., :3].astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29) >> 8).astype(np.uint8)
+
+
+def text_bbox(gray: np.ndarray) -> Tuple[int, int, int, int] | None:
+    """Return (top, bottom, left, right) of the rows and columns holding strong edges, or None for a flat image.
+
+    Subtitle text has the strongest edges in the strip (outlined glyphs on a diff or video background), so pixels
+    with at least `EDGE_THRESHOLD` of the largest edge are taken as text and projected onto both axes.
+    """
+    gray = gray.astype(np.int16)
+    edges = np.zeros(gray.shape, dtype=np.int16)
+    edges[:, 1:] = np.abs(np.diff(gray, axis=1))
+    edges[1:, :] = np.maximum(edges[1:, :], np.abs(np.diff(gray, axis=0)))
+
+    strong = edges >= max(MIN_EDGE, int(edges.max() * EDGE_THRESHOLD))
+    row_counts = strong.sum(axis=1)
+    col_counts = strong.sum(axis=0)
+    if row_counts.max() == 0:
+        return None
+
+    # Ignore rows and columns with only a few stray edge pixels (noise, compression artifacts).
+    rows = np.flatnonzero(row_counts >= max(1, row_counts.max() // 20))
+    cols = np.flatnonzero(col_counts >= max(1, col_counts.max() // 20))
+    return (int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1)
+
+
+def trim_image(image: np.ndarray, pad: int = 8, grayscale: bool = False) -> np.ndarray:
+    """Crop an HxW or HxWx3 image to its text plus `pad` pixels, optionally as a single gray plane."""
+    gray = to_gray(image)
+    bbox = text_bbox(gray)
+    if grayscale:
+        image = gray
+    if bbox is None:
+        return image
+
+    top, bottom, left, right = bbox
+    height, width = gray.shape
+    return np.ascontiguousarray(
+        image[max(0, top - pad) : min(height, bottom + pad), max(0, left - pad) : min(width, right + pad)]
+    )
+
+
+def trim_images_dir(src_dir: Path, dst_dir: Path, pad: int = 8, grayscale: bool = False) -> Path:
+    """Write a trimmed copy of every image in `src_dir` to `dst_dir` under the same name and return `dst_dir`.
+
+    `dst_dir` is emptied first, so images left from an earlier run are not OCRed again.
+    """
+    shutil.rmtree(dst_dir, ignore_errors=True)
+    dst_dir.mkdir(parents=True)
+
+    def _trim(src_path: Path) -> None:
+        with Image.open(src_path) as img:
+            image = np.asarray(img.convert("RGB"))
+        trimmed = Image.fromarray(trim_image(image, pad, grayscale))
+        dst_path = dst_dir / src_path.relative_to(src_dir)
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        if dst_path.suffix.lower() in (".jpg", ".jpeg"):
+            trimmed.save(dst_path, quality=95)
+        else:
+            trimmed.save(dst_path)
+
+    with ThreadPoolExecutor(thread_name_prefix="image_trim") as executor:
+        list(executor.map(_trim, collect_images(src_dir)))
+    return dst_dir
@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import io
 import os
 import platform
@@ -6,12 +7,15 @@ import re
 import shutil
 import unicodedata
 from pathlib import Path
-from typing import Callable, List, Literal
+from typing import TYPE_CHECKING, Callable, List, Literal
 
 from PIL import Image, UnidentifiedImageError
 
 from engine import Engine, OCREngine, OCREngineType
 
+if TYPE_CHECKING:
+    import numpy as np
+
 DOUBLE_QUOTE_REGEX = re.compile(
     "|".join(["«", "‹", "»", "›", "„", "“", "‟", "”", "❝", "❞", "❮", "❯", "〝", "〞", "〟", "＂", "＂"])
 )
@@ -106,10 +110,25 @@ def fix_quotes(text: str) -> str:
     return text
 
 
-def get_image_raw_bytes_and_dims(image_path: str) -> tuple[bytes, int, int] | None:
+def open_image(image: "str | Path | bytes | np.ndarray") -> Image.Image:
+    """Open an image from a file path, encoded bytes or an HxW / HxWx3 uint8 array."""
+    if isinstance(image, (str, Path)):
+        return Image.open(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(image))
+    return Image.fromarray(image)
+
+
+def describe_image(image: "str | Path | bytes | np.ndarray") -> str:
+    if isinstance(image, (str, Path)):
+        return str(image)
+    return f"<in-memory {type(image).__name__}>"
+
+
+def get_image_raw_bytes_and_dims(image: "str | Path | bytes | np.ndarray") -> tuple[bytes, int, int] | None:
 
     try:
-        with Image.open(image_path) as img:
+        with open_image(image) as img:
             width = img.width
             height = img.height
             limit_width = 1100
@@ -122,20 +141,41 @@ def get_image_raw_bytes_and_dims(image_path: str) -> tuple[bytes, int, int] | No
             return (image_bytes.getvalue(), width, height)
 
     except FileNotFoundError:
-        print(f"Error: Image file not found at '{image_path}'")
+        print(f"Error: Image file not found at '{describe_image(image)}'")
         return None
     except UnidentifiedImageError:
-        print(f"Error: Pillow (PIL) cannot identify '{image_path}' as an image. Cannot get dimensions.")
+        print(f"Error: Pillow (PIL) cannot identify '{describe_image(image)}' as an image. Cannot get dimensions.")
         return None
     except IOError as e:
-        print(f"Error reading raw file bytes from '{image_path}': {e}")
+        print(f"Error reading raw file bytes from '{describe_image(image)}': {e}")
         return None
     except Exception as e:
         # Add type hints to help static analysis if possible, but Exception is broad
-        print(f"An unexpected error occurred processing '{image_path}': {e}")
+        print(f"An unexpected error occurred processing '{describe_image(image)}': {e}")
         return None
 
 
+def get_image_encoded_bytes(image: "str | Path | bytes | np.ndarray") -> tuple[bytes, str]:
+    """Return already encoded image bytes and their format, encoding arrays to PNG."""
+    if isinstance(image, (str, Path)):
+        image_format = "jpeg"
+        if str(image).lower().endswith((".png",)):
+            image_format = "png"
+        elif str(image).lower().endswith((".webp",)):
+            image_format = "webp"
+        with open(image, "rb") as image_file:
+            return (image_file.read(), image_format)
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        with open_image(image) as img:
+            return (bytes(image), (img.format or "png").lower())
+
+    image_bytes = io.BytesIO()
+    with open_image(image) as img:
+        img.save(image_bytes, format="PNG", compress_level=3)
+    return (image_bytes.getvalue(), "png")
+
+
 def float_range(mini: float, maxi: float) -> Callable[..., float]:
     """Return function handle of an argument type function for
     ArgumentParser checking a float range: mini <= arg <= maxi
@@ -204,15 +244,32 @@ def collect_images(images_dir: Path) -> List[Path]:
     
     return sorted(images)
     
+def file_fingerprint(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    """Hash the size and three chunks (start, middle, end) of a file, fast even for whole episodes."""
+    path = Path(path)
+    size = path.stat().st_size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with path.open("rb") as video_file:
+        for offset in sorted({0, max(0, size // 2 - chunk_size // 2), max(0, size - chunk_size)}):
+            _ = video_file.seek(offset)
+            digest.update(video_file.read(chunk_size))
+    return digest.hexdigest()
+
+def split_image_name(name: str) -> tuple[str | None, str]:
+    """Split `{region}_{timecode}` image names into the region name and the timecode part.
+
+    Region names start with a letter, so older names that begin with the timecode have no region.
+    """
+    region, _, timecode_part = name.partition('_')
+    if region[:1].isalpha():
+        return (region, timecode_part)
+    return (None, name)
+
 def timecode_key(item):
     filename: str = item[0]
     try:
         name_without_ext = filename.rsplit('.', 1)[0]
-        
-        if name_without_ext.startswith(('bot_', 'top_')):
-            timecode_part = '_'.join(name_without_ext.split('_')[1:])
-        else:
-            timecode_part = name_without_ext
+        _, timecode_part = split_image_name(name_without_ext)
         
         start_timecode = timecode_part.split('__')[0]
         parts = start_timecode.split('_')
@@ -230,7 +287,7 @@ def create_ocr_engine(ocr_engine_type: OCREngineType, args) -> OCREngine:
     if ocr_engine_type == OCREngineType.GGLENS:
         from gglens import GoogleLens
         
-        return GoogleLens(threads=args.gglens_thread)
+        return GoogleLens(threads=args.gglens_thread, hedge_rate=args.gglens_hedge_rate)
     
     elif ocr_engine_type == OCREngineType.GEMINI:
         from gemini import Gemini
@@ -247,6 +304,31 @@ def create_ocr_engine(ocr_engine_type: OCREngineType, args) -> OCREngine:
             gemini_kwargs["promt"] = args.gemini_prompt
         
         return Gemini(**gemini_kwargs)
+
+    elif ocr_engine_type == OCREngineType.ONNX:
+        from onnxocr import OnnxOCR
+
+        if not args.onnx_model or not args.onnx_dict:
+            raise ValueError("--onnx_model and --onnx_dict are required for the onnx OCR engine.")
+
+        return OnnxOCR(
+            model_path=args.onnx_model,
+            dict_path=args.onnx_dict,
+            threads=args.onnx_threads,
+            batch_size=args.onnx_batch_size,
+        )
+
+    elif ocr_engine_type == OCREngineType.SCHEDULER:
+        from scheduler import Scheduler
+
+        backends: List[OCREngine] = []
+        for name in args.scheduler_backends.split(","):
+            backend_type = OCREngineType.from_string(name.strip())
+            if backend_type == OCREngineType.SCHEDULER:
+                raise ValueError("Scheduler cannot be used as its own backend.")
+            backends.append(create_ocr_engine(backend_type, args))
+
+        return Scheduler(backends)
     
     else:
         raise ValueError(f"Unknown OCR engine: {ocr_engine_type}")
\ No newline at end of file